@@ -8,10 +8,8 @@ import functools
 import json
 import logging
 import random
-import re
-import shlex
 import socket
-import urllib.parse
+import time
 import zlib
 
 import aiofiles
@@ -21,16 +19,51 @@ import MultiServer
 import shortuuid
 import tortoise.exceptions
 import websockets
-from quart import Quart, abort, jsonify, request
-from tortoise import Tortoise
+from quart import Quart, abort, jsonify, redirect, request
 
+import accounting
+import blobstore
+import cluster
+import commands
+import db
 import models
-import settings
+import snapshot
 
 multiworld_servers = {}
 
 APP = Quart(__name__)
 
+accounting.install()
+
+@APP.before_request
+async def track_db_operation():
+    db.current_operation.set(request.endpoint)
+
+
+@APP.before_request
+async def route_to_owner():
+    # in cluster mode, send requests for games hosted on another node to that node
+    if not cluster.enabled() or cluster.PROXY_HEADER in request.headers:
+        return None
+
+    token = (request.view_args or {}).get('token', None) or request.args.get('token', None)
+    if token is None or token in multiworld_servers:
+        return None
+
+    try:
+        world = await db.get_world(token)
+    except tortoise.exceptions.DoesNotExist:
+        return None
+
+    if not cluster.is_owned_elsewhere(world):
+        return None
+
+    if cluster.ROUTING == 'redirect':
+        return redirect(cluster.owner_url(world, request.full_path), 307)
+
+    return await cluster.proxy(world, request.method, request.full_path, await request.get_data(), request.headers)
+
+
 @APP.route('/game', methods=['POST'])
 async def create_game():
     data = await request.get_json()
@@ -38,17 +71,21 @@ async def create_game():
     if 'token' in data:
         token = data['token']
         try:
-            world = await models.Multiworlds.get(token=token)
+            world = await db.get_world(token)
         except tortoise.exceptions.DoesNotExist:
             abort(404, description=f'Game with token {token} was not found.')
 
-        if token in multiworld_servers:
+        if token in multiworld_servers or cluster.is_owned_elsewhere(world):
             abort(400, description=f'Game with token {token} is already active.')
 
-        ctx = await init_multiserver(world, resume=True)
+        try:
+            ctx = await init_multiserver(world, resume=True)
+        except cluster.NotOwnerError:
+            # another node reopened it between the check above and our claim
+            abort(400, description=f'Game with token {token} is already active.')
     else:
         token=shortuuid.ShortUUID().random(length=10)
-        world = await models.Multiworlds.create(
+        world = await db.create_world(
             token=token,
             multidata_url=data['multidata_url'],
             admin=data['admin'],
@@ -58,9 +95,6 @@ async def create_game():
             password=data.get('password', None),
         )
 
-        world.token = token
-        await world.save()
-
         ctx = await init_multiserver(world)
 
     response = APP.response_class(
@@ -74,7 +108,7 @@ async def create_game():
 
 @APP.route('/game', methods=['GET'])
 async def get_all_games():
-    worlds = await models.Multiworlds.filter(active=True)
+    worlds = await db.get_active_worlds()
     response = APP.response_class(
         response=json.dumps(
             {
@@ -90,7 +124,7 @@ async def get_all_games():
 
 @APP.route('/game/<string:token>', methods=['GET'])
 async def get_game(token):
-    world = await models.Multiworlds.get(token=token)
+    world = await db.get_world(token)
 
     response = APP.response_class(
         response=json.dumps(get_multiworld_info(world), default=simple_multiworld_converter),
@@ -105,7 +139,7 @@ async def get_game(token):
 async def update_game_message(token):
     data = await request.get_json()
     try:
-        world = await models.Multiworlds.get(token=token)
+        world = await db.get_world(token)
     except tortoise.exceptions.DoesNotExist:
         abort(404, description=f'Game with token {token} was not found.')
 
@@ -115,25 +149,37 @@ async def update_game_message(token):
     if not 'msg' in data:
         abort(400)
 
-    # Specifically handle /exit command, though this should be handled by server_command_processor
-    if data['msg'] == '/exit':
-        await close_game(world)
-        return jsonify(resp='Game closed.', success=True)
+    try:
+        command, kwargs = commands.parse_chat(data['msg'])
+    except commands.CommandError as e:
+        return jsonify(resp=str(e), success=False)
+
+    if command is None:
+        return jsonify(resp=None, success=True)
 
     try:
-        resp = await server_command_processor(multiworld_servers[token], data['msg'], world)
-        return jsonify(resp=resp, success=True)
+        resp, success = await commands.dispatch(command, kwargs, multiworld_servers[token], world)
+        return jsonify(resp=resp, success=success)
     except Exception as e:
-        logging.exception("Exception in server_command_processor")
+        logging.exception("Exception in command %s", command.name)
         return jsonify(resp=str(e), success=False)
 
 
+# maps the API parameter name to the Multiworlds field it updates
+GAME_PARAMETERS = {
+    'noexpiry': 'noexpiry',
+    'admin': 'admin',
+    'meta': 'meta',
+    'racemode': 'race',
+}
+
+
 @APP.route('/game/<string:token>/<string:param>', methods=['PUT'])
 async def update_game_parameter(token, param):
     data = await request.get_json()
 
     try:
-        world = await models.Multiworlds.get(token=token)
+        world = await db.get_world(token)
     except tortoise.exceptions.DoesNotExist:
         abort(404, description=f'Game with token {token} was not found.')
 
@@ -143,16 +189,12 @@ async def update_game_parameter(token, param):
     if not 'value' in data:
         abort(400)
 
-    if param == 'noexpiry':
-        world.noexpiry = data['value']
-    elif param == 'admin':
-        world.admin = data['value']
-    elif param == 'meta':
-        world.admin = data['value']
-    elif param == 'racemode':
-        world.race = data['value']
+    field = GAME_PARAMETERS.get(param, None)
+    if field is None:
+        abort(400, description=f'Unknown parameter {param}.')
 
-    await world.save()
+    setattr(world, field, data['value'])
+    await db.save(world, field)
 
     return jsonify(success=True)
 
@@ -160,7 +202,7 @@ async def update_game_parameter(token, param):
 @APP.route('/game/<string:token>', methods=['DELETE'])
 async def delete_game(token):
     try:
-        world = await models.Multiworlds.get(token=token)
+        world = await db.get_world(token)
     except tortoise.exceptions.DoesNotExist:
         abort(404, description=f'Game with token {token} was not found.')
 
@@ -175,86 +217,102 @@ async def delete_game(token):
 async def cmd(token):
     data = await request.get_json()
 
-    cmd = data.get('command', None)
-    if cmd is None:
+    if data.get('command', None) is None:
         abort(400, description='No command specified.')
 
-    try:
-        world = await models.Multiworlds.get(token=token)
-    except tortoise.exceptions.DoesNotExist:
-        abort(404, description=f'Game with token {token} was not found.')
+    world, ctx = await get_active_game(token)
 
-    if token not in multiworld_servers:
-        abort(404, description=f'Game with token {token} is not currently active, but has previously existed.')
+    resp, success = await run_command(data, ctx, world)
+    return jsonify(resp=resp, success=success)
 
 
-    ctx = multiworld_servers[token]
+@APP.route('/game/<string:token>/cmd/batch', methods=['PUT'])
+async def cmd_batch(token):
+    data = await request.get_json()
+
+    batch = data.get('commands', None)
+    if not isinstance(batch, list):
+        abort(400, description='No commands specified.')
+
+    # parse everything up front so a bad entry doesn't leave the batch half applied
+    parsed = []
+    errors = []
+    for i, item in enumerate(batch):
+        if not isinstance(item, dict):
+            errors.append(f'Entry {i}: expected an object.')
+            continue
+        try:
+            parsed.append((item.get('command', None), *commands.parse_request(item)))
+        except commands.CommandError as e:
+            errors.append(f'Entry {i}: {e}')
+
+    if errors:
+        abort(400, description=' '.join(errors))
+
+    world, ctx = await get_active_game(token)
+
+    results = []
+    for name, command, kwargs in parsed:
+        try:
+            resp, success = await commands.dispatch(command, kwargs, ctx, world)
+        except Exception as e:
+            logging.exception("Exception in command %s", command.name)
+            resp, success = str(e), False
+        results.append({'command': name, 'resp': resp, 'success': success})
+
+    return jsonify(results=results, success=all(r['success'] for r in results))
 
-    if cmd == 'kick':
-        team = data.get('team', None)
-        name = data.get('name', None)
 
-        if name is None:
-            return jsonify(resp="No player specified.", success=False)
+@APP.route('/commands/timings', methods=['GET'])
+async def command_timings():
+    return jsonify(commands.get_timings())
 
-        for client in ctx.clients:
-            if client.auth and client.name.lower() == name.lower() and (team is None or team == client.team):
-                if client.socket and not client.socket.closed:
-                    await client.socket.close()
-                    return jsonify(resp=f"Kicked player '{name}'.", success=True)
 
-        return jsonify(resp=f"Player '{name}' not found.", success=False)
+@APP.route('/db/stats', methods=['GET'])
+async def db_stats():
+    return jsonify(db.get_stats())
 
-    elif cmd == 'senditem':
-        player = data.get('player', None)
-        item = data.get('item', None)
 
-        if player is None:
-            return jsonify(resp="No player specified.", success=False)
-        if item is None:
-            return jsonify(resp="No item specified.", success=False)
+@APP.route('/admin/resources', methods=['GET'])
+async def resource_overview():
+    usage = {token: accounting.get_usage(ctx) for token, ctx in multiworld_servers.items()}
+    # jsonify sorts keys, which would lose the largest-first ordering of games
+    response = APP.response_class(
+        response=json.dumps({
+            'count': len(usage),
+            'throttled': [token for token, u in usage.items() if u['throttled']],
+            'games': dict(sorted(usage.items(), key=lambda i: i[1]['memory_bytes'], reverse=True)),
+        }),
+        status=200,
+        mimetype='application/json'
+    )
+    return response
 
-        if item in MultiServer.Items.item_table:
-            for client in ctx.clients:
-                if client.auth and client.name.lower() == player.lower():
-                    new_item = MultiServer.ReceivedItem(MultiServer.Items.item_table[item][3], "cheat console", client.slot)
-                    MultiServer.get_received_items(ctx, client.team, client.slot).append(new_item)
-                    MultiServer.notify_all(ctx, 'Cheat console: sending "' + item + '" to ' + client.name)
-            MultiServer.send_new_items(ctx)
-            return jsonify(resp=f"Sent {item} to {player}.", success=True)
 
-        logging.warning("Unknown item: " + item)
-        return jsonify(resp=f"Unknown item: {item}", success=False)
+@APP.route('/snapshots/timings', methods=['GET'])
+async def snapshot_timings():
+    return jsonify(snapshot.RESTORE_TIMINGS)
 
-    elif cmd == 'forfeit':
-        team = data.get('team', None)
-        name = data.get('name', None)
-        if name is None:
-            return jsonify(resp="No name specified.", success=False)
-        for client in ctx.clients:
-            if client.auth and client.name.lower() == name and (team is None or team == client.team):
-                if client.socket and not client.socket.closed:
-                    MultiServer.forfeit_player(ctx, client.team, client.slot)
-                    return jsonify(resp=f"Forfeited player '{name}'.", success=True)
 
-        return jsonify(resp=f"Player '{name}' not found.", success=False)
+async def get_active_game(token):
+    try:
+        world = await db.get_world(token)
+    except tortoise.exceptions.DoesNotExist:
+        abort(404, description=f'Game with token {token} was not found.')
 
-    elif cmd == 'close':
-        await close_game(world)
-        return jsonify(resp='Game closed.', success=True)
+    if token not in multiworld_servers:
+        abort(404, description=f'Game with token {token} is not currently active, but has previously existed.')
 
-    elif cmd == 'password':
-        password = data.get('password', None)
-        MultiServer.set_password(ctx, password)
-        world.password = password
-        await world.save()
+    return world, multiworld_servers[token]
 
-        if password:
-            return jsonify(resp='Password set.', success=True)
 
-        return jsonify(resp='Password removed.', success=True)
+async def run_command(data, ctx: MultiServer.Context, world: models.Multiworlds):
+    try:
+        command, kwargs = commands.parse_request(data)
+    except commands.CommandError as e:
+        return str(e), False
 
-    return jsonify(resp=f"Invalid command {cmd}", success=False)
+    return await commands.dispatch(command, kwargs, ctx, world)
 
 
 # These routes are for autocomplete in the frontend app (SahasrahBot)
@@ -310,8 +368,10 @@ async def autocomplete_item():
 async def cleanup(minutes):
     worlds_cleaned = []
     now = datetime.datetime.now(datetime.timezone.utc)
-    worlds = await models.Multiworlds.filter(active=True)
+    worlds = await db.get_active_worlds()
     for world in worlds:
+        if world.token not in multiworld_servers:
+            continue
         if world.updated_at < now-datetime.timedelta(minutes=minutes) and not world.noexpiry:
             worlds_cleaned.append(world.token)
             await close_game(world)
@@ -344,9 +404,11 @@ def get_multiworld_info(world: models.Multiworlds):
         'created_at': world.created_at,
         'updated_at': world.updated_at,
         'active': world.active,
+        'node': world.node,
         'open': get_open_status(world.token),
         'players': get_player_list(world.token),
         'connected_clients': get_connected_clients(world.token),
+        'resources': accounting.get_usage(multiworld_servers.get(world.token, None)),
     }
 
 def get_open_status(token):
@@ -402,11 +464,19 @@ def get_server_port(token):
 
 async def close_game(world: models.Multiworlds):
     world.active = False
-    await world.save()
+    if cluster.enabled():
+        # give up the lease so any node can reopen the game straight away
+        world.node = None
+        world.lease_expires_at = None
+        await db.save(world, 'active', 'node', 'lease_expires_at')
+    else:
+        await db.save(world, 'active')
     ctx: MultiServer.Context = multiworld_servers[world.token]
     ctx.server.ws_server.close()
     del multiworld_servers[world.token]
 
+commands.set_close_handler(close_game)
+
 
 def is_port_in_use(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -418,108 +488,88 @@ def simple_multiworld_converter(o):
 
 @APP.before_serving
 async def load_worlds():
-    worlds = await models.Multiworlds.filter(active=True)
+    # in cluster mode games owned by other (or dead) nodes are picked up by the heartbeat instead
+    if cluster.enabled():
+        worlds = await cluster.get_owned_worlds()
+    else:
+        worlds = await db.get_active_worlds()
 
     for world in worlds:
-        print(f"Restoring {world.token}")
-        try:
-            await init_multiserver(world, resume=True)
-        except FileNotFoundError:
-            print(f"Failed to restore {world.token}, marking this server is inactive and continuing...")
-            world.active = False
-            await world.save()
-
-# Hopefully we can just retire this in the future
-async def server_command_processor(ctx: MultiServer.Context, raw_input: str, world: models.Multiworlds):
-    command = shlex.split(raw_input)
-    if not command:
-        return
+        await restore_world(world)
+
+    if cluster.enabled():
+        asyncio.get_event_loop().create_task(cluster.heartbeat(lambda: list(multiworld_servers), restore_world, release_world))
 
-    if command[0] == '/players':
-        logging.info(MultiServer.get_connected_players_string(ctx))
-        return "Players: " + MultiServer.get_connected_players_string(ctx)
-    if command[0] == '/password':
-        MultiServer.set_password(ctx, command[1] if len(command) > 1 else None)
-        world.password = command[1] if len(command) > 1 else None
-        await world.save()
-        return "Password set."
-    if command[0] == '/kick' and len(command) > 1:
-        team = int(command[2]) - 1 if len(command) > 2 and command[2].isdigit() else None
-        for client in ctx.clients:
-            if client.auth and client.name.lower() == command[1].lower() and (team is None or team == client.team):
-                if client.socket and not client.socket.closed:
-                    await client.socket.close()
-                    return f"Kicked player '{command[1]}'."
-
-        return f"Player '{command[1]}' not found."
-
-    if command[0] == '/forfeitslot' and len(command) > 1 and command[1].isdigit():
-        if len(command) > 2 and command[2].isdigit():
-            team = int(command[1]) - 1
-            slot = int(command[2])
-        else:
-            team = 0
-            slot = int(command[1])
-        MultiServer.forfeit_player(ctx, team, slot)
-        return f"Forfeited player in slot {slot} on team {team + 1}."
-    if command[0] == '/forfeitplayer' and len(command) > 1:
-        team = int(command[2]) - 1 if len(command) > 2 and command[2].isdigit() else None
-        for client in ctx.clients:
-            if client.auth and client.name.lower() == command[1].lower() and (team is None or team == client.team):
-                if client.socket and not client.socket.closed:
-                    MultiServer.forfeit_player(ctx, client.team, client.slot)
-                    return f"Forfeited player {command[1]} from team {team + 1}."
-    if command[0] == '/senditem' and len(command) > 2:
-        [(player, item)] = re.findall(r'\S* (\S*) (.*)', raw_input)
-        if item in MultiServer.Items.item_table:
-            for client in ctx.clients:
-                if client.auth and client.name.lower() == player.lower():
-                    new_item = MultiServer.ReceivedItem(MultiServer.Items.item_table[item][3], "cheat console", client.slot)
-                    MultiServer.get_received_items(ctx, client.team, client.slot).append(new_item)
-                    MultiServer.notify_all(ctx, 'Cheat console: sending "' + item + '" to ' + client.name)
-            MultiServer.send_new_items(ctx)
-            return f"Sent {item} to {player}."
-        else:
-            logging.warning("Unknown item: " + item)
-            return f"Unknown item: {item}"
-
-    if command[0][0] != '/':
-        MultiServer.notify_all(ctx, '[Server]: ' + raw_input)
+    asyncio.get_event_loop().create_task(snapshot.snapshot_loop(lambda: multiworld_servers))
+    asyncio.get_event_loop().create_task(accounting.accounting_loop(lambda: multiworld_servers))
 
+def release_world(token):
+    # stop hosting a game locally without touching its row, which now belongs to another node
+    ctx: MultiServer.Context = multiworld_servers.pop(token, None)
+    if ctx is not None:
+        ctx.server.ws_server.close()
+
+async def restore_world(world: models.Multiworlds):
+    print(f"Restoring {world.token}")
+    try:
+        await init_multiserver(world, resume=True)
+    except FileNotFoundError:
+        print(f"Failed to restore {world.token}, marking this server is inactive and continuing...")
+        world.active = False
+        await db.save(world, 'active')
+    except cluster.NotOwnerError:
+        print(f"{world.token} is now owned by node {world.node}, skipping...")
 
 async def init_multiserver(world: models.Multiworlds, resume=False):
     port = get_valid_multiworld_port(world.port)
 
     token = world.token
 
-    if resume:
-        if token in multiworld_servers:
-            raise Exception(f'Game with token {token} is already open.')
+    if resume and token in multiworld_servers:
+        raise Exception(f'Game with token {token} is already open.')
 
-        async with aiofiles.open(f"data/{token}_multidata", "rb") as multidata_file:
-            binary = await multidata_file.read()
+    if cluster.enabled():
+        taking_over = world.node != cluster.NODE_ID
+        if not await cluster.claim(world):
+            raise cluster.NotOwnerError(f'Game with token {token} is owned by node {world.node}.')
+
+    if resume:
+        # a node taking over a game must not trust a stale local copy of its files
+        prefer_local = not cluster.enabled() or not taking_over
+        await blobstore.pull(f"{token}_multidata", prefer_local=prefer_local)
+        for name in (f"{token}_multisave", f"{token}_snapshot"):
+            try:
+                await blobstore.pull(name, prefer_local=prefer_local)
+            except FileNotFoundError:
+                pass
     else:
         async with aiohttp.request(method='get', url=world.multidata_url, headers={'User-Agent': 'SahasrahBot Multiworld Service'}) as resp:
             binary = await resp.read()
 
-        async with aiofiles.open(f"data/{token}_multidata", "wb") as multidata_file:
+        async with aiofiles.open(blobstore.local_path(f"{token}_multidata"), "wb") as multidata_file:
             await multidata_file.write(binary)
+        await blobstore.push(f"{token}_multidata")
 
-    # crude check that it's a valid multidata file
-    json.loads(zlib.decompress(binary).decode("utf-8"))
+        # crude check that it's a valid multidata file, restored games are checked when they're loaded
+        json.loads(zlib.decompress(binary).decode("utf-8"))
 
+    start = time.perf_counter()
     ctx = await open_multiserver(
         port,
-        f"data/{token}_multidata",
+        blobstore.local_path(f"{token}_multidata"),
         racemode=world.race,
         password=world.password
     )
+    if ctx is None:
+        raise Exception(f'Failed to read multiworld data for {token}.')
+    if resume:
+        snapshot.record_restore(token, time.perf_counter() - start, ctx)
 
     multiworld_servers[token] = ctx
 
     world.active = True
     world.port = port
-    await world.save()
+    await db.save(world, 'active', 'port')
 
     return ctx
 
@@ -543,8 +593,26 @@ async def open_multiserver(port: int, multidatafile: str, racemode: bool=False,
     MultiServer.init_lookups(ctx)
     ctx.data_filename = multidatafile
     ctx.disable_client_forfeit = racemode
+    if not ctx.disable_save and not ctx.save_filename:
+        ctx.save_filename = (ctx.data_filename[:-9] if ctx.data_filename[-9:] == 'multidata' else (
+            ctx.data_filename + '_')) + 'multisave'
+
+    # multidata never changes after download, so hash it once for snapshot validation
+    ctx.multidata_hash = await asyncio.get_event_loop().run_in_executor(None, snapshot.file_hash, ctx.data_filename)
+    ctx.restored_from_snapshot = await snapshot.restore(ctx)
+
+    if 'multidata' not in ctx.restored_from_snapshot and not load_multidata(ctx):
+        return
 
+    if not ctx.disable_save and 'multisave' not in ctx.restored_from_snapshot:
+        load_multisave(ctx)
 
+    ctx.usage = accounting.GameUsage()
+    ctx.server = websockets.serve(functools.partial(accounting.metered_server,ctx=ctx), ctx.host, ctx.port, ping_timeout=None, ping_interval=None)
+    await ctx.server
+    return ctx
+
+def load_multidata(ctx: MultiServer.Context):
     try:
         with open(ctx.data_filename, 'rb') as f:
             jsonobj = json.loads(zlib.decompress(f.read()).decode("utf-8"))
@@ -556,39 +624,28 @@ async def open_multiserver(port: int, multidatafile: str, racemode: bool=False,
             ctx.locations = {tuple(k): tuple(v) for k, v in jsonobj['locations']}
     except Exception as e:
         logging.error('Failed to read multiworld data (%s)' % e)
-        return
+        return False
 
-    if not ctx.disable_save:
-        if not ctx.save_filename:
-            ctx.save_filename = (ctx.data_filename[:-9] if ctx.data_filename[-9:] == 'multidata' else (
-                ctx.data_filename + '_')) + 'multisave'
-        try:
-            with open(ctx.save_filename, 'rb') as f:
-                jsonobj = json.loads(zlib.decompress(f.read()).decode("utf-8"))
-                rom_names = jsonobj[0]
-                received_items = {tuple(k): [MultiServer.ReceivedItem(**i) for i in v] for k, v in jsonobj[1]}
-                if not all([ctx.rom_names[tuple(rom)] == (team, slot) for rom, (team, slot) in rom_names]):
-                    raise Exception('Save file mismatch, will start a new game')
-                ctx.received_items = received_items
-                logging.info('Loaded save file with %d received items for %d players' % (sum([len(p) for p in received_items.values()]), len(received_items)))
-        except FileNotFoundError:
-            logging.error('No save data found, starting a new game')
-        except Exception as e:
-            logging.exception(e)
-
-    ctx.server = websockets.serve(functools.partial(MultiServer.server,ctx=ctx), ctx.host, ctx.port, ping_timeout=None, ping_interval=None)
-    await ctx.server
-    return ctx
+    return True
 
-async def database():
-    await Tortoise.init(
-        db_url=f'mysql://{settings.DB_USER}:{urllib.parse.quote_plus(settings.DB_PASS)}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}',
-        modules={'models': ['models']}
-    )
+def load_multisave(ctx: MultiServer.Context):
+    try:
+        with open(ctx.save_filename, 'rb') as f:
+            jsonobj = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            rom_names = jsonobj[0]
+            received_items = {tuple(k): [MultiServer.ReceivedItem(**i) for i in v] for k, v in jsonobj[1]}
+            if not all([ctx.rom_names[tuple(rom)] == (team, slot) for rom, (team, slot) in rom_names]):
+                raise Exception('Save file mismatch, will start a new game')
+            ctx.received_items = received_items
+            logging.info('Loaded save file with %d received items for %d players' % (sum([len(p) for p in received_items.values()]), len(received_items)))
+    except FileNotFoundError:
+        logging.error('No save data found, starting a new game')
+    except Exception as e:
+        logging.exception(e)
 
 if __name__ == '__main__':
     loop = asyncio.get_event_loop()
 
-    dbtask = loop.create_task(database())
+    dbtask = loop.create_task(db.init())
     loop.run_until_complete(dbtask)
     APP.run(host='127.0.0.1', port=5002, use_reloader=False)
@@ -0,0 +1,241 @@
+###########
+# Per-game resource accounting and soft limits
+###########
+import asyncio
+import functools
+import itertools
+import logging
+import sys
+import time
+
+import aiohttp
+import MultiServer
+import websockets
+
+import broadcast
+import db
+import settings
+
+RESOURCE_CHECK_SECONDS = getattr(settings, 'RESOURCE_CHECK_SECONDS', 60)
+# soft limits, None disables that limit.  cpu and bandwidth are per RESOURCE_CHECK_SECONDS window
+RESOURCE_LIMIT_MEMORY_BYTES = getattr(settings, 'RESOURCE_LIMIT_MEMORY_BYTES', None)
+RESOURCE_LIMIT_CPU_SECONDS = getattr(settings, 'RESOURCE_LIMIT_CPU_SECONDS', None)
+RESOURCE_LIMIT_BYTES_OUT = getattr(settings, 'RESOURCE_LIMIT_BYTES_OUT', None)
+RESOURCE_WARNING_WEBHOOK = getattr(settings, 'RESOURCE_WARNING_WEBHOOK', None)
+
+SIZE_SAMPLE = 100
+
+
+class GameUsage:
+    def __init__(self):
+        self.cpu_seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.messages_in = 0
+        self.messages_out = 0
+        self.memory_bytes = 0
+        self.throttled = False
+        self.over_budget = []
+
+        # totals at the start of the current check window
+        self._window = (0.0, 0)
+        self.window_cpu_seconds = 0.0
+        self.window_bytes_out = 0
+
+    def to_dict(self):
+        return {
+            'memory_bytes': self.memory_bytes,
+            'cpu_seconds': round(self.cpu_seconds, 4),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'messages_in': self.messages_in,
+            'messages_out': self.messages_out,
+            'window_cpu_seconds': round(self.window_cpu_seconds, 4),
+            'window_bytes_out': self.window_bytes_out,
+            'throttled': self.throttled,
+            'over_budget': self.over_budget,
+        }
+
+
+class TimedCoroutine:
+    """
+    Awaits a coroutine, adding the CPU time of each synchronous step it runs to usage.
+    Time spent suspended (waiting on the network, sleeping, or running other games'
+    handlers) isn't counted.
+    """
+    def __init__(self, coro, usage: GameUsage):
+        self._coro = coro
+        self._usage = usage
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            start = time.thread_time()
+            try:
+                if error is None:
+                    yielded = self._coro.send(value)
+                else:
+                    yielded = self._coro.throw(error)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self._usage.cpu_seconds += time.thread_time() - start
+
+            try:
+                value, error = (yield yielded), None
+            except GeneratorExit:
+                self._coro.close()
+                raise
+            except BaseException as e:
+                value, error = None, e
+
+
+def install():
+    """Time MultiServer's client command handler against the usage of the game it runs for."""
+    handler = MultiServer.process_client_cmd
+    if getattr(handler, 'timed', False):
+        return
+
+    @functools.wraps(handler)
+    async def timed_process_client_cmd(ctx, *args, **kwargs):
+        usage = getattr(ctx, 'usage', None)
+        if usage is None:
+            return await handler(ctx, *args, **kwargs)
+        return await TimedCoroutine(handler(ctx, *args, **kwargs), usage)
+
+    timed_process_client_cmd.timed = True
+    MultiServer.process_client_cmd = timed_process_client_cmd
+
+
+class MeteredSocket:
+    """
+    Wraps a client websocket to count the traffic it receives.  Sent traffic is counted by
+    the broadcast.QueuedSocket underneath, as frames go out.
+    """
+    def __init__(self, socket, usage: GameUsage):
+        self._socket = socket
+        self._usage = usage
+
+    def __getattr__(self, name):
+        return getattr(self._socket, name)
+
+    async def recv(self):
+        message = await self._socket.recv()
+        self._usage.bytes_in += broadcast.message_size(message)
+        self._usage.messages_in += 1
+        return message
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except websockets.ConnectionClosedOK:
+            raise StopAsyncIteration
+
+
+async def metered_server(websocket, path, ctx: MultiServer.Context):
+    queued = broadcast.QueuedSocket(websocket, ctx.usage)
+    try:
+        await MultiServer.server(MeteredSocket(queued, ctx.usage), path, ctx)
+    finally:
+        queued.close_writer()
+
+
+def approx_size(container):
+    """Estimate the size of a dict/list/set by measuring a sample of its entries."""
+    size = sys.getsizeof(container)
+    if not container:
+        return size
+
+    entries = container.items() if isinstance(container, dict) else container
+    sample = list(itertools.islice(entries, SIZE_SAMPLE))
+    sampled = sum(_entry_size(e) for e in sample)
+    return size + int(sampled * len(container) / len(sample))
+
+
+def _entry_size(entry):
+    if isinstance(entry, (tuple, list)):
+        return sys.getsizeof(entry) + sum(_entry_size(e) for e in entry)
+    return sys.getsizeof(entry)
+
+
+def approx_memory(ctx: MultiServer.Context):
+    size = approx_size(ctx.locations) + approx_size(ctx.player_names) + approx_size(ctx.rom_names)
+    size += approx_size(ctx.received_items)
+    size += sum(approx_size(items) for items in ctx.received_items.values())
+
+    for client in ctx.clients:
+        socket = client.socket
+        transport = getattr(socket, 'transport', None)
+        if transport is not None:
+            size += transport.get_write_buffer_size()
+        size += sum(len(m) for m in getattr(socket, 'messages', ()))
+        if hasattr(socket, 'queued_bytes'):
+            size += socket.queued_bytes()
+
+    return size
+
+
+def check(ctx: MultiServer.Context):
+    """Close the current window for a game and return the limits it went over."""
+    usage: GameUsage = ctx.usage
+    usage.memory_bytes = approx_memory(ctx)
+    usage.window_cpu_seconds = usage.cpu_seconds - usage._window[0]
+    usage.window_bytes_out = usage.bytes_out - usage._window[1]
+    usage._window = (usage.cpu_seconds, usage.bytes_out)
+
+    over_budget = []
+    if RESOURCE_LIMIT_MEMORY_BYTES is not None and usage.memory_bytes > RESOURCE_LIMIT_MEMORY_BYTES:
+        over_budget.append('memory')
+    if RESOURCE_LIMIT_CPU_SECONDS is not None and usage.window_cpu_seconds > RESOURCE_LIMIT_CPU_SECONDS:
+        over_budget.append('cpu')
+    if RESOURCE_LIMIT_BYTES_OUT is not None and usage.window_bytes_out > RESOURCE_LIMIT_BYTES_OUT:
+        over_budget.append('bandwidth')
+
+    usage.over_budget = over_budget
+    usage.throttled = bool(over_budget)
+    return over_budget
+
+
+async def warn_admin(token, over_budget):
+    try:
+        world = await db.get_world(token)
+    except Exception:
+        logging.exception("Could not look up %s to warn its admin", token)
+        return
+
+    message = f"Multiworld {token} is over its resource budget ({', '.join(over_budget)}) and is being throttled."
+    logging.warning("%s (admin %s)", message, world.admin)
+
+    if RESOURCE_WARNING_WEBHOOK is None:
+        return
+
+    content = f"<@{world.admin}> {message}" if world.admin else message
+    try:
+        async with aiohttp.request(method='post', url=RESOURCE_WARNING_WEBHOOK, json={'content': content}) as resp:
+            resp.raise_for_status()
+    except Exception:
+        logging.exception("Failed to send resource warning for %s", token)
+
+
+async def accounting_loop(get_servers):
+    while True:
+        await asyncio.sleep(RESOURCE_CHECK_SECONDS)
+        for token, ctx in list(get_servers().items()):
+            try:
+                was_throttled = ctx.usage.throttled
+                over_budget = check(ctx)
+                if over_budget and not was_throttled:
+                    await warn_admin(token, over_budget)
+            except Exception:
+                logging.exception("Resource check failed for %s", token)
+
+
+def get_usage(ctx: MultiServer.Context):
+    if ctx is None:
+        return None
+
+    ctx.usage.memory_bytes = approx_memory(ctx)
+    return ctx.usage.to_dict()
@@ -0,0 +1,105 @@
+###########
+# Storage for game files (multidata/multisave) shared between cluster nodes
+###########
+import abc
+import importlib
+import os
+
+import aiofiles
+
+import settings
+
+DATA_DIR = 'data'
+BLOB_STORE_CLASS = getattr(settings, 'BLOB_STORE_CLASS', 'blobstore.LocalBlobStore')
+BLOB_STORE_PATH = getattr(settings, 'BLOB_STORE_PATH', DATA_DIR)
+
+
+class BlobStore(abc.ABC):
+    """
+    Base class for blob stores.  Implementations need to provide read, write and exists,
+    keyed by file name (e.g. "<token>_multidata").
+    """
+    @abc.abstractmethod
+    async def read(self, name: str) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    async def write(self, name: str, data: bytes):
+        pass
+
+    @abc.abstractmethod
+    async def exists(self, name: str) -> bool:
+        pass
+
+
+class LocalBlobStore(BlobStore):
+    """Stores blobs in a local (or network mounted) directory."""
+    def __init__(self, path: str = BLOB_STORE_PATH):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.path, name)
+
+    async def read(self, name: str) -> bytes:
+        async with aiofiles.open(self._path(name), "rb") as f:
+            return await f.read()
+
+    async def write(self, name: str, data: bytes):
+        async with aiofiles.open(self._path(name), "wb") as f:
+            await f.write(data)
+
+    async def exists(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def is_data_dir(self):
+        return os.path.abspath(self.path) == os.path.abspath(DATA_DIR)
+
+
+_store = None
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    if _store is None:
+        module_name, class_name = BLOB_STORE_CLASS.rsplit('.', 1)
+        _store = getattr(importlib.import_module(module_name), class_name)()
+    return _store
+
+
+def local_path(name: str):
+    return os.path.join(DATA_DIR, name)
+
+
+def _is_data_dir(store: BlobStore):
+    return isinstance(store, LocalBlobStore) and store.is_data_dir()
+
+
+async def push(name: str):
+    """Copy a file from the local data directory into the blob store."""
+    store = get_blob_store()
+    if _is_data_dir(store):
+        return
+
+    async with aiofiles.open(local_path(name), "rb") as f:
+        data = await f.read()
+    await store.write(name, data)
+
+
+async def pull(name: str, prefer_local=False):
+    """
+    Refresh a file in the local data directory from the blob store.  Falls back to an
+    existing local copy, and raises FileNotFoundError if neither has it.
+    """
+    if prefer_local and os.path.exists(local_path(name)):
+        return
+
+    store = get_blob_store()
+    if _is_data_dir(store) or not await store.exists(name):
+        if os.path.exists(local_path(name)):
+            return
+        raise FileNotFoundError(name)
+
+    data = await store.read(name)
+    async with aiofiles.open(local_path(name), "wb") as f:
+        await f.write(data)
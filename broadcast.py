@@ -0,0 +1,127 @@
+###########
+# Host-side websocket fan-out: per-client send queues and pre-serialized broadcasts
+###########
+import asyncio
+import json
+import logging
+
+import MultiServer
+import websockets
+
+import settings
+
+SEND_QUEUE_SIZE = getattr(settings, 'SEND_QUEUE_SIZE', 256)
+# what to do when a client's send queue is full, either 'disconnect' or 'drop'
+SEND_QUEUE_POLICY = getattr(settings, 'SEND_QUEUE_POLICY', 'disconnect')
+ITEM_COALESCE_SECONDS = getattr(settings, 'ITEM_COALESCE_SECONDS', 0.05)
+# how long an over-budget game's writers wait before each send, letting other games go first
+RESOURCE_THROTTLE_DELAY = getattr(settings, 'RESOURCE_THROTTLE_DELAY', 0.05)
+
+
+def message_size(message):
+    # text frames go out as UTF-8, so count encoded bytes rather than characters
+    return len(message.encode('utf-8')) if isinstance(message, str) else len(message)
+
+
+class QueuedSocket:
+    """
+    Wraps a client websocket so sending only enqueues the message.  A writer task per
+    connection drains the queue, so a slow client can't hold up sends to everyone else.
+    If the game's usage is over budget the writer waits RESOURCE_THROTTLE_DELAY per message.
+    Outgoing traffic is counted against usage once a frame has actually been sent, so
+    frames that are dropped or never go out don't count towards the game's budget.
+    """
+    def __init__(self, socket, usage=None):
+        self._socket = socket
+        self._usage = usage
+        self._queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self._queued_bytes = 0
+        self._writer = None
+        self._closing = False
+        self.dropped = 0
+
+    def __getattr__(self, name):
+        return getattr(self._socket, name)
+
+    async def send(self, message):
+        self.enqueue(message)
+
+    def enqueue(self, message, size=None):
+        if self._closing or self._socket.closed:
+            return
+
+        if self._writer is None:
+            self._writer = asyncio.get_event_loop().create_task(self._drain())
+
+        size = message_size(message) if size is None else size
+        try:
+            self._queue.put_nowait((message, size))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if SEND_QUEUE_POLICY == 'disconnect':
+                logging.warning("Send queue full for %s, disconnecting", self._socket.remote_address)
+                self._disconnect()
+            return
+        self._queued_bytes += size
+
+    async def _drain(self):
+        while True:
+            message, size = await self._queue.get()
+            self._queued_bytes -= size
+            try:
+                if self._usage is not None and self._usage.throttled:
+                    await asyncio.sleep(RESOURCE_THROTTLE_DELAY)
+                await self._socket.send(message)
+                if self._usage is not None:
+                    self._usage.bytes_out += size
+                    self._usage.messages_out += 1
+            except websockets.ConnectionClosed:
+                return
+            except Exception:
+                logging.exception("Failed to send to %s, disconnecting", self._socket.remote_address)
+                self._writer = None
+                self._disconnect()
+                return
+
+    def _disconnect(self):
+        self._closing = True
+        self.close_writer()
+        # don't wait on the closing handshake of a client that has already stalled
+        asyncio.get_event_loop().create_task(self._socket.close())
+
+    def close_writer(self):
+        if self._writer is not None:
+            self._writer.cancel()
+
+    def queued_bytes(self):
+        return self._queued_bytes
+
+
+def broadcast(ctx: MultiServer.Context, msgs):
+    """Serialize msgs once and queue the same payload for every authenticated client."""
+    payload = json.dumps(msgs)
+    size = len(payload.encode('utf-8'))
+    for client in ctx.clients:
+        if client.auth and client.socket and not client.socket.closed:
+            client.socket.enqueue(payload, size)
+
+
+def notify_all(ctx: MultiServer.Context, text):
+    logging.info("Notice (all): %s" % text)
+    broadcast(ctx, [['Print', text]])
+
+
+def send_new_items(ctx: MultiServer.Context):
+    """
+    Schedule MultiServer.send_new_items for this game.  Calls within ITEM_COALESCE_SECONDS
+    of the first are folded into it, so each client gets one ReceivedItems frame per burst.
+    """
+    if getattr(ctx, 'pending_item_flush', None) is not None:
+        return
+
+    ctx.pending_item_flush = asyncio.get_event_loop().call_later(ITEM_COALESCE_SECONDS, _flush_items, ctx)
+
+
+def _flush_items(ctx: MultiServer.Context):
+    ctx.pending_item_flush = None
+    MultiServer.send_new_items(ctx)
@@ -0,0 +1,149 @@
+###########
+# Cluster mode: several service instances sharing the Multiworlds table
+###########
+import asyncio
+import datetime
+import logging
+import os
+
+import aiohttp
+from tortoise.expressions import Q
+
+import blobstore
+import db
+import models
+import settings
+
+NODE_ID = getattr(settings, 'CLUSTER_NODE_ID', None)
+NODE_URL = getattr(settings, 'CLUSTER_NODE_URL', None)
+LEASE_SECONDS = getattr(settings, 'CLUSTER_LEASE_SECONDS', 30)
+HEARTBEAT_SECONDS = getattr(settings, 'CLUSTER_HEARTBEAT_SECONDS', 10)
+# either 'proxy' or 'redirect'
+ROUTING = getattr(settings, 'CLUSTER_ROUTING', 'proxy')
+
+PROXY_HEADER = 'X-Multiworld-Proxied-By'
+
+
+class NotOwnerError(Exception):
+    pass
+
+
+def enabled():
+    return NODE_ID is not None
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def lease_expiry():
+    return now() + datetime.timedelta(seconds=LEASE_SECONDS)
+
+
+def orphaned():
+    return Q(node__isnull=True) | Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now())
+
+
+def is_owned_elsewhere(world: models.Multiworlds):
+    if not enabled() or not world.active or world.node in (None, NODE_ID):
+        return False
+
+    return world.lease_expires_at is not None and world.lease_expires_at > now()
+
+
+async def claim(world: models.Multiworlds):
+    """
+    Take ownership of a game if it is already ours or its lease has lapsed.  This is a
+    single conditional UPDATE, so only one node can win a race for an orphaned game.
+    """
+    expires = lease_expiry()
+    count = await db.retry(
+        lambda: models.Multiworlds.filter(Q(node=NODE_ID) | orphaned(), id=world.id).update(
+            node=NODE_ID,
+            node_url=NODE_URL,
+            lease_expires_at=expires,
+        ),
+        kind='write'
+    )
+    if not count:
+        return False
+
+    world.node = NODE_ID
+    world.node_url = NODE_URL
+    world.lease_expires_at = expires
+    return True
+
+
+async def renew(tokens):
+    """Renew the leases on the given games, returning the tokens another node has taken over."""
+    if not tokens:
+        return set()
+
+    await db.retry(
+        lambda: models.Multiworlds.filter(node=NODE_ID, token__in=tokens).update(lease_expires_at=lease_expiry()),
+        kind='write'
+    )
+    # the leases were just extended, so nothing can be taken over between the update and this check
+    owned = await db.retry(
+        lambda: models.Multiworlds.filter(node=NODE_ID, token__in=tokens).values_list('token', flat=True)
+    )
+    return set(tokens) - set(owned)
+
+
+async def get_owned_worlds():
+    return await db.retry(lambda: models.Multiworlds.filter(active=True, node=NODE_ID))
+
+
+async def get_orphaned_worlds():
+    return await db.retry(lambda: models.Multiworlds.filter(orphaned(), active=True))
+
+
+async def heartbeat(get_local_tokens, takeover, release):
+    """
+    Renew the leases of games hosted here, push their save files to the blob store and
+    take over any active game whose owner has stopped heartbeating.  Games this node has
+    lost to another node (e.g. after stalling past its lease) are released locally.
+    """
+    save_mtimes = {}
+    while True:
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        try:
+            tokens = get_local_tokens()
+            lost = await renew(tokens)
+            for token in lost:
+                logging.warning("Game %s was taken over by another node, closing the local copy", token)
+                release(token)
+                save_mtimes.pop(token, None)
+            tokens = [token for token in tokens if token not in lost]
+
+            for token in tokens:
+                name = f"{token}_multisave"
+                try:
+                    mtime = os.path.getmtime(blobstore.local_path(name))
+                except FileNotFoundError:
+                    continue
+                if save_mtimes.get(token) != mtime:
+                    await blobstore.push(name)
+                    save_mtimes[token] = mtime
+
+            for world in await get_orphaned_worlds():
+                if world.token in tokens:
+                    continue
+                logging.info("Taking over orphaned game %s from node %s", world.token, world.node)
+                try:
+                    await takeover(world)
+                except Exception:
+                    logging.exception("Failed to take over %s", world.token)
+        except Exception:
+            logging.exception("Cluster heartbeat failed")
+
+
+def owner_url(world: models.Multiworlds, full_path: str):
+    return world.node_url.rstrip('/') + full_path
+
+
+async def proxy(world: models.Multiworlds, method: str, full_path: str, body: bytes, headers: dict):
+    headers = {k: v for k, v in headers.items() if k.lower() in ('content-type', 'accept')}
+    headers[PROXY_HEADER] = NODE_ID
+    async with aiohttp.request(method=method, url=owner_url(world, full_path), data=body, headers=headers) as resp:
+        return await resp.read(), resp.status, {'Content-Type': resp.content_type}
@@ -0,0 +1,266 @@
+###########
+# Command registry shared by the REST, chat (/msg) and batch endpoints
+###########
+import logging
+import shlex
+import time
+
+import MultiServer
+
+import broadcast
+import db
+import models
+
+COMMANDS = {}
+ALIASES = {}
+COMMAND_TIMINGS = {}
+
+# set by the app, closes a game and removes it from the hosted games
+_close_handler = None
+
+
+class CommandError(Exception):
+    pass
+
+
+class Argument:
+    def __init__(self, name, type=str, required=True, default=None, greedy=False, chat_type=None):
+        self.name = name
+        self.type = type
+        self.required = required
+        self.default = default
+        self.greedy = greedy
+        self.chat_type = chat_type or type
+
+    def convert(self, value, chat=False):
+        if value is None:
+            return None
+        try:
+            return (self.chat_type if chat else self.type)(value)
+        except (TypeError, ValueError):
+            raise CommandError(f"Invalid value for {self.name}: {value}")
+
+
+class Command:
+    def __init__(self, name, handler, args=(), aliases=()):
+        self.name = name
+        self.handler = handler
+        self.args = list(args)
+        self.aliases = list(aliases)
+
+    def bind(self, data: dict):
+        """Build handler kwargs from a dict of already-split values (REST/batch)."""
+        kwargs = {}
+        for arg in self.args:
+            value = data.get(arg.name, None)
+            if value is None:
+                if arg.required:
+                    raise CommandError(f"No {arg.name} specified.")
+                kwargs[arg.name] = arg.default
+            else:
+                kwargs[arg.name] = arg.convert(value)
+        return kwargs
+
+    def bind_chat(self, tokens: list):
+        """
+        Build handler kwargs from positional chat tokens.  Optional arguments are only
+        filled, left to right, when there are more tokens than required arguments.
+        """
+        required = len([a for a in self.args if a.required])
+        if len(tokens) < required:
+            missing = [a.name for a in self.args if a.required][len(tokens)]
+            raise CommandError(f"No {missing} specified.")
+
+        optional_budget = len(tokens) - required
+        kwargs = {}
+        tokens = list(tokens)
+        for arg in self.args:
+            if not arg.required:
+                if optional_budget <= 0:
+                    kwargs[arg.name] = arg.default
+                    continue
+                optional_budget -= 1
+
+            if arg.greedy:
+                value = ' '.join(tokens)
+                tokens = []
+            else:
+                value = tokens.pop(0)
+            kwargs[arg.name] = arg.convert(value, chat=True)
+        return kwargs
+
+
+def command(name, *args, aliases=()):
+    def decorator(func):
+        cmd = Command(name, func, args, aliases)
+        COMMANDS[name] = cmd
+        for alias in aliases:
+            ALIASES[alias] = name
+        return func
+    return decorator
+
+
+def get_command(name: str) -> Command:
+    name = ALIASES.get(name, name)
+    try:
+        return COMMANDS[name]
+    except KeyError:
+        raise CommandError(f"Invalid command {name}")
+
+
+def parse_chat(raw_input: str):
+    """Parse a chat line into (command, kwargs).  Lines not starting with / are broadcast."""
+    if not raw_input or not raw_input.strip():
+        return None, None
+
+    if raw_input[0] != '/':
+        return COMMANDS['say'], {'message': raw_input}
+
+    try:
+        tokens = shlex.split(raw_input)
+    except ValueError as e:
+        raise CommandError(f"Could not parse command: {e}")
+
+    cmd = get_command(tokens[0][1:])
+    return cmd, cmd.bind_chat(tokens[1:])
+
+
+def parse_request(data: dict):
+    name = data.get('command', None)
+    if name is None:
+        raise CommandError("No command specified.")
+
+    cmd = get_command(name)
+    return cmd, cmd.bind(data)
+
+
+async def dispatch(cmd: Command, kwargs: dict, ctx: MultiServer.Context, world: models.Multiworlds):
+    """Run a parsed command, returning (resp, success)."""
+    start = time.perf_counter()
+    try:
+        resp = await cmd.handler(ctx, world, **kwargs)
+        success = True
+    except CommandError as e:
+        resp = str(e)
+        success = False
+    finally:
+        record_timing(cmd.name, time.perf_counter() - start)
+
+    return resp, success
+
+
+def record_timing(name, elapsed):
+    stats = COMMAND_TIMINGS.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+    stats['count'] += 1
+    stats['total'] += elapsed
+    stats['max'] = max(stats['max'], elapsed)
+
+
+def get_timings():
+    return {
+        name: {
+            'count': s['count'],
+            'total_ms': s['total'] * 1000,
+            'avg_ms': s['total'] * 1000 / s['count'],
+            'max_ms': s['max'] * 1000,
+        } for name, s in COMMAND_TIMINGS.items()
+    }
+
+
+def set_close_handler(handler):
+    global _close_handler
+    _close_handler = handler
+
+
+# lookup helpers
+
+def team_from_chat(value):
+    return int(value) - 1
+
+
+def find_client(ctx: MultiServer.Context, name: str, team: int = None):
+    for client in ctx.clients:
+        if client.auth and client.name.lower() == name.lower() and (team is None or team == client.team):
+            if client.socket and not client.socket.closed:
+                return client
+    return None
+
+
+def find_clients(ctx: MultiServer.Context, name: str):
+    return [c for c in ctx.clients if c.auth and c.name.lower() == name.lower()]
+
+
+# commands
+
+@command('players')
+async def players(ctx: MultiServer.Context, world: models.Multiworlds):
+    connected = MultiServer.get_connected_players_string(ctx)
+    logging.info(connected)
+    return "Players: " + connected
+
+
+@command('password', Argument('password', required=False))
+async def password(ctx: MultiServer.Context, world: models.Multiworlds, password=None):
+    MultiServer.set_password(ctx, password)
+    world.password = password
+    await db.save(world, 'password')
+
+    if password:
+        return 'Password set.'
+
+    return 'Password removed.'
+
+
+@command('kick', Argument('name'), Argument('team', int, required=False, chat_type=team_from_chat))
+async def kick(ctx: MultiServer.Context, world: models.Multiworlds, name, team=None):
+    client = find_client(ctx, name, team)
+    if client is None:
+        raise CommandError(f"Player '{name}' not found.")
+
+    await client.socket.close()
+    return f"Kicked player '{name}'."
+
+
+@command('forfeitslot', Argument('team', int, required=False, default=0, chat_type=team_from_chat), Argument('slot', int))
+async def forfeitslot(ctx: MultiServer.Context, world: models.Multiworlds, slot, team=0):
+    MultiServer.forfeit_player(ctx, team, slot)
+    return f"Forfeited player in slot {slot} on team {team + 1}."
+
+
+@command('forfeitplayer', Argument('name'), Argument('team', int, required=False, chat_type=team_from_chat), aliases=['forfeit'])
+async def forfeitplayer(ctx: MultiServer.Context, world: models.Multiworlds, name, team=None):
+    client = find_client(ctx, name, team)
+    if client is None:
+        raise CommandError(f"Player '{name}' not found.")
+
+    MultiServer.forfeit_player(ctx, client.team, client.slot)
+    return f"Forfeited player '{name}' from team {client.team + 1}."
+
+
+@command('senditem', Argument('player'), Argument('item', greedy=True))
+async def senditem(ctx: MultiServer.Context, world: models.Multiworlds, player, item):
+    if item not in MultiServer.Items.item_table:
+        logging.warning("Unknown item: " + item)
+        raise CommandError(f"Unknown item: {item}")
+
+    for client in find_clients(ctx, player):
+        new_item = MultiServer.ReceivedItem(MultiServer.Items.item_table[item][3], "cheat console", client.slot)
+        MultiServer.get_received_items(ctx, client.team, client.slot).append(new_item)
+        broadcast.notify_all(ctx, 'Cheat console: sending "' + item + '" to ' + client.name)
+    broadcast.send_new_items(ctx)
+    return f"Sent {item} to {player}."
+
+
+@command('say', Argument('message', greedy=True))
+async def say(ctx: MultiServer.Context, world: models.Multiworlds, message):
+    broadcast.notify_all(ctx, '[Server]: ' + message)
+    return None
+
+
+@command('close', aliases=['exit'])
+async def close(ctx: MultiServer.Context, world: models.Multiworlds):
+    if _close_handler is None:
+        raise CommandError("Closing games is not available.")
+
+    await _close_handler(world)
+    return 'Game closed.'
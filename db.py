@@ -0,0 +1,201 @@
+###########
+# Data access helpers for Multiworlds: pool configuration, retry and write coalescing
+###########
+import asyncio
+import contextvars
+import logging
+import urllib.parse
+
+import tortoise.exceptions
+from tortoise import Tortoise
+
+import models
+import settings
+
+DB_POOL_MINSIZE = getattr(settings, 'DB_POOL_MINSIZE', 1)
+DB_POOL_MAXSIZE = getattr(settings, 'DB_POOL_MAXSIZE', 10)
+DB_CONNECT_TIMEOUT = getattr(settings, 'DB_CONNECT_TIMEOUT', 10)
+DB_POOL_RECYCLE = getattr(settings, 'DB_POOL_RECYCLE', 3600)
+DB_RETRIES = getattr(settings, 'DB_RETRIES', 3)
+DB_RETRY_BACKOFF = getattr(settings, 'DB_RETRY_BACKOFF', 0.5)
+
+TRANSIENT_ERRORS = (
+    tortoise.exceptions.DBConnectionError,
+    ConnectionError,
+    asyncio.TimeoutError,
+)
+# errors that are never worth retrying, some of these subclass OperationalError
+PERMANENT_ERRORS = (
+    tortoise.exceptions.IntegrityError,
+    tortoise.exceptions.DoesNotExist,
+    tortoise.exceptions.MultipleObjectsReturned,
+)
+# MySQL client errors for a lost or refused connection (CR_CONNECTION_ERROR, CR_CONN_HOST_ERROR,
+# CR_SERVER_GONE_ERROR, CR_SERVER_LOST, CR_SERVER_LOST_EXTENDED)
+CONNECTION_LOST_CODES = {2002, 2003, 2006, 2013, 2055}
+
+# number of queries issued through this module, keyed by kind, in total and per API operation
+DB_CALLS = {'read': 0, 'write': 0, 'retry': 0, 'coalesced': 0}
+DB_CALLS_BY_OPERATION = {}
+# the API operation (route endpoint) currently being handled, set by the app
+current_operation = contextvars.ContextVar('current_operation', default=None)
+
+# pk -> the next write to that row, which later saves are merged into until it goes out
+_pending_writes = {}
+# pks with a write in flight
+_flushing = set()
+
+
+def get_db_url():
+    # DB_URL lets the service run against another backend, e.g. sqlite://:memory: for testing
+    db_url = getattr(settings, 'DB_URL', None)
+    if db_url is not None:
+        return db_url
+
+    params = urllib.parse.urlencode({
+        'minsize': DB_POOL_MINSIZE,
+        'maxsize': DB_POOL_MAXSIZE,
+        'connect_timeout': DB_CONNECT_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+    })
+    return f'mysql://{settings.DB_USER}:{urllib.parse.quote_plus(settings.DB_PASS)}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}?{params}'
+
+
+async def init(generate_schemas=False):
+    await Tortoise.init(
+        db_url=get_db_url(),
+        modules={'models': ['models']}
+    )
+    if generate_schemas:
+        await Tortoise.generate_schemas()
+
+
+def is_transient(e: Exception):
+    if isinstance(e, PERMANENT_ERRORS):
+        return False
+    if isinstance(e, TRANSIENT_ERRORS):
+        return True
+
+    # the MySQL backend wraps driver errors, including dropped connections, in a plain OperationalError
+    if type(e) is tortoise.exceptions.OperationalError and e.args:
+        cause = e.args[0]
+        if isinstance(cause, TRANSIENT_ERRORS):
+            return True
+        code = cause.args[0] if isinstance(cause, Exception) and cause.args else None
+        return code in CONNECTION_LOST_CODES
+
+    return False
+
+
+def count(kind):
+    DB_CALLS[kind] += 1
+    operation = current_operation.get()
+    if operation is not None:
+        calls = DB_CALLS_BY_OPERATION.setdefault(operation, {k: 0 for k in DB_CALLS})
+        calls[kind] += 1
+
+
+async def retry(func, kind='read'):
+    """
+    Await func(), retrying with exponential backoff on transient connection errors.
+    func must return a fresh awaitable on every call.
+    """
+    attempt = 0
+    while True:
+        count(kind)
+        try:
+            return await func()
+        except PERMANENT_ERRORS:
+            raise
+        except Exception as e:
+            if not is_transient(e) or attempt >= DB_RETRIES:
+                raise
+            delay = DB_RETRY_BACKOFF * 2 ** attempt
+            attempt += 1
+            count('retry')
+            logging.warning("Database error (%s), retrying in %.2fs (attempt %d/%d)", e, delay, attempt, DB_RETRIES)
+            await asyncio.sleep(delay)
+
+
+async def get_world(token: str) -> models.Multiworlds:
+    return await retry(lambda: models.Multiworlds.get(token=token))
+
+
+async def get_active_worlds():
+    return await retry(lambda: models.Multiworlds.filter(active=True))
+
+
+async def create_world(**kwargs) -> models.Multiworlds:
+    attempts = 0
+
+    async def create():
+        nonlocal attempts
+        attempts += 1
+        try:
+            return await models.Multiworlds.create(**kwargs)
+        except tortoise.exceptions.IntegrityError:
+            if attempts == 1:
+                raise
+            # the INSERT of an earlier attempt committed before its connection was lost
+            world = await models.Multiworlds.get(token=kwargs['token'])
+            if any(getattr(world, field) != value for field, value in kwargs.items()):
+                raise
+            return world
+
+    return await retry(create, kind='write')
+
+
+async def save(world: models.Multiworlds, *fields: str):
+    """
+    Persist the given fields of world.  A save to a row that is idle is written straight
+    away; saves that arrive while a write to the same row is in flight are merged into a
+    single UPDATE that goes out once it finishes.
+    """
+    if not fields:
+        return await retry(world.save, kind='write')
+
+    values = {field: getattr(world, field) for field in fields}
+
+    pending = _pending_writes.get(world.pk)
+    if pending is not None:
+        pending['world'] = world
+        pending['values'].update(values)
+        count('coalesced')
+        return await asyncio.shield(pending['future'])
+
+    loop = asyncio.get_running_loop()
+    pending = {'world': world, 'values': values, 'future': loop.create_future()}
+    _pending_writes[world.pk] = pending
+    if world.pk not in _flushing:
+        _flushing.add(world.pk)
+        loop.create_task(_flush(world.pk))
+    return await asyncio.shield(pending['future'])
+
+
+async def _flush(pk):
+    try:
+        while pk in _pending_writes:
+            await _write(_pending_writes.pop(pk))
+    finally:
+        _flushing.discard(pk)
+
+
+async def _write(pending):
+    world = pending['world']
+    for field, value in pending['values'].items():
+        setattr(world, field, value)
+    # updated_at drives expiry in the cleanup job, so always bump it
+    update_fields = list(pending['values']) + ['updated_at']
+    try:
+        await retry(lambda: world.save(update_fields=update_fields), kind='write')
+    except Exception as e:
+        pending['future'].set_exception(e)
+    else:
+        pending['future'].set_result(None)
+
+
+def get_stats():
+    return {
+        'total': dict(DB_CALLS),
+        'operations': {operation: dict(calls) for operation, calls in DB_CALLS_BY_OPERATION.items()},
+    }
@@ -1,8 +1,6 @@
 import models
 import asyncio
-import settings
-from tortoise import Tortoise
-import urllib.parse
+import db
 import json
 import tortoise.exceptions
 
@@ -25,16 +23,10 @@ async def migrate():
         except tortoise.exceptions.IntegrityError:
             print(f"Failed to migrate {token} because it already exists.")
 
-async def database():
-    await Tortoise.init(
-        db_url=f'mysql://{settings.DB_USER}:{urllib.parse.quote_plus(settings.DB_PASS)}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}',
-        modules={'models': ['models']}
-    )
-
 if __name__ == '__main__':
     loop = asyncio.get_event_loop()
 
-    dbtask = loop.create_task(database())
+    dbtask = loop.create_task(db.init())
     loop.run_until_complete(dbtask)
     migrate = loop.create_task(migrate())
     loop.run_until_complete(migrate)
\ No newline at end of file
@@ -0,0 +1,15 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE `multiworlds` ADD `node` VARCHAR(255);
+        ALTER TABLE `multiworlds` ADD `node_url` VARCHAR(2000);
+        ALTER TABLE `multiworlds` ADD `lease_expires_at` DATETIME(6);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE `multiworlds` DROP COLUMN `node`;
+        ALTER TABLE `multiworlds` DROP COLUMN `node_url`;
+        ALTER TABLE `multiworlds` DROP COLUMN `lease_expires_at`;"""
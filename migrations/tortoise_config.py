@@ -1,10 +1,8 @@
-import urllib.parse
-
-import settings
+import db
 
 
 TORTOISE_ORM = {
-    "connections": {"default": f'mysql://{settings.DB_USER}:{urllib.parse.quote_plus(settings.DB_PASS)}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}'},
+    "connections": {"default": db.get_db_url()},
     "apps": {
         "models": {
             "models": ["models", "aerich.models"],
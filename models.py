@@ -13,4 +13,7 @@ class Multiworlds(Model):
     created_at = fields.DatetimeField(auto_now_add=True)
     updated_at = fields.DatetimeField(auto_now=True)
     active = fields.BooleanField(default=False)
-    password = fields.CharField(max_length=255, null=True)
\ No newline at end of file
+    password = fields.CharField(max_length=255, null=True)
+    node = fields.CharField(max_length=255, null=True)
+    node_url = fields.CharField(max_length=2000, null=True)
+    lease_expires_at = fields.DatetimeField(null=True)
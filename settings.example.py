@@ -4,4 +4,39 @@ DB_NAME = "dbname"
 DB_USER = "user"
 DB_PASS = "pass"
 
-USE_SAVED_WORLDS_JSON = True
\ No newline at end of file
+USE_SAVED_WORLDS_JSON = True
+
+# Optional database tuning, defaults shown
+# DB_URL = "sqlite://:memory:"  # overrides the MySQL settings above
+# DB_POOL_MINSIZE = 1
+# DB_POOL_MAXSIZE = 10
+# DB_CONNECT_TIMEOUT = 10
+# DB_POOL_RECYCLE = 3600
+# DB_RETRIES = 3
+# DB_RETRY_BACKOFF = 0.5
+
+# Cluster mode, disabled unless CLUSTER_NODE_ID is set
+# CLUSTER_NODE_ID = "node1"
+# CLUSTER_NODE_URL = "http://10.0.0.1:5002"  # how other nodes reach this node's API
+# CLUSTER_LEASE_SECONDS = 30
+# CLUSTER_HEARTBEAT_SECONDS = 10
+# CLUSTER_ROUTING = "proxy"  # or "redirect"
+# BLOB_STORE_CLASS = "blobstore.LocalBlobStore"
+# BLOB_STORE_PATH = "/mnt/shared/multiworld"  # must be shared between nodes
+
+# How often live games are snapshotted for fast restarts
+# SNAPSHOT_SECONDS = 60
+
+# Per-game soft resource limits, None disables a limit.  Games over budget have their
+# outbound messages delayed and their admin is warned (via the webhook, if set).
+# RESOURCE_CHECK_SECONDS = 60
+# RESOURCE_LIMIT_MEMORY_BYTES = None
+# RESOURCE_LIMIT_CPU_SECONDS = None  # per check window
+# RESOURCE_LIMIT_BYTES_OUT = None  # per check window
+# RESOURCE_THROTTLE_DELAY = 0.05
+# RESOURCE_WARNING_WEBHOOK = None
+
+# Websocket fan-out
+# SEND_QUEUE_SIZE = 256  # messages queued per client before SEND_QUEUE_POLICY applies
+# SEND_QUEUE_POLICY = "disconnect"  # or "drop"
+# ITEM_COALESCE_SECONDS = 0.05
@@ -0,0 +1,169 @@
+###########
+# Snapshots of each game's derived state, so restarts don't have to re-decode multidata/multisave
+###########
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+import zlib
+
+import aiofiles
+import MultiServer
+
+import blobstore
+import settings
+
+# snapshots are zlib compressed JSON so a snapshot pulled from shared storage can't run code
+# when loaded.  Mappings are stored as columns (one list per tuple member) that zip() turns
+# straight back into tuple keys and values, without a Python-level loop per entry.
+VERSION = 3
+SNAPSHOT_SECONDS = getattr(settings, 'SNAPSHOT_SECONDS', 60)
+
+# token -> details of how long the last restore of that game took
+RESTORE_TIMINGS = {}
+
+
+def snapshot_filename(ctx: MultiServer.Context):
+    return (ctx.data_filename[:-9] if ctx.data_filename[-9:] == 'multidata' else (
+        ctx.data_filename + '_')) + 'snapshot'
+
+
+def file_hash(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def columns(rows, width):
+    # e.g. [(0, 1, 'Alice'), (0, 2, 'Bob')] -> [[0, 0], [1, 2], ['Alice', 'Bob']]
+    return [list(c) for c in zip(*rows)] or [[] for _ in range(width)]
+
+
+def build(ctx: MultiServer.Context, multisave_hash):
+    return {
+        'version': VERSION,
+        'multidata_hash': ctx.multidata_hash,
+        'multisave_hash': multisave_hash,
+        'player_names': columns(((team, slot, name) for (team, slot), name in ctx.player_names.items()), 3),
+        'rom_names': columns(((list(rom), team, slot) for rom, (team, slot) in ctx.rom_names.items()), 3),
+        'remote_items': list(ctx.remote_items),
+        'locations': columns((k + v for k, v in ctx.locations.items()), 4),
+        'received_items': [[team, slot, *columns(items, 3)] for (team, slot), items in ctx.received_items.items()],
+        'send_index': [[c.team, c.slot, c.send_index] for c in ctx.clients if c.auth],
+    }
+
+
+def encode(snap):
+    return zlib.compress(json.dumps(snap, separators=(',', ':')).encode('utf-8'), 1)
+
+
+def load(filename):
+    with open(filename, 'rb') as f:
+        return json.loads(zlib.decompress(f.read()).decode('utf-8'))
+
+
+def signature(ctx: MultiServer.Context):
+    # cheap check for whether anything worth snapshotting changed since last time
+    return (
+        sum(len(items) for items in ctx.received_items.values()),
+        tuple(sorted((c.team, c.slot, c.send_index) for c in ctx.clients if c.auth)),
+    )
+
+
+async def write(ctx: MultiServer.Context):
+    filename = snapshot_filename(ctx)
+    loop = asyncio.get_event_loop()
+
+    # hash the multisave before capturing state, so the captured items are never older than
+    # the file the hash describes
+    multisave_hash = None
+    if ctx.save_filename:
+        multisave_hash = await loop.run_in_executor(None, file_hash, ctx.save_filename)
+    # the built snapshot shares nothing mutable with ctx, so it can be encoded off the loop
+    binary = await loop.run_in_executor(None, encode, build(ctx, multisave_hash))
+
+    async with aiofiles.open(filename + '.tmp', 'wb') as f:
+        await f.write(binary)
+    os.replace(filename + '.tmp', filename)
+
+    await blobstore.push(os.path.basename(filename))
+
+
+async def restore(ctx: MultiServer.Context):
+    """
+    Load ctx state from its snapshot where the snapshot still matches the source files.
+    Returns the set of sources ('multidata', 'multisave') that no longer need to be parsed.
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        snap = await loop.run_in_executor(None, load, snapshot_filename(ctx))
+    except FileNotFoundError:
+        return set()
+    except Exception as e:
+        logging.warning('Ignoring unreadable snapshot %s (%s)', snapshot_filename(ctx), e)
+        return set()
+
+    if not isinstance(snap, dict) or snap.get('version') != VERSION or snap.get('multidata_hash') != ctx.multidata_hash:
+        return set()
+
+    try:
+        teams, slots, names = snap['player_names']
+        player_names = dict(zip(zip(teams, slots), names))
+        roms, teams, slots = snap['rom_names']
+        rom_names = dict(zip(map(tuple, roms), zip(teams, slots)))
+        remote_items = set(snap['remote_items'])
+        location_ids, finders, location_items, owners = snap['locations']
+        locations = dict(zip(zip(location_ids, finders), zip(location_items, owners)))
+        # tuple.__new__ is what ReceivedItem._make does, without a Python call per item
+        received_items = {
+            (team, slot): list(map(tuple.__new__, itertools.repeat(MultiServer.ReceivedItem), zip(*item_columns)))
+            for team, slot, *item_columns in snap['received_items']
+        }
+        send_index = {(team, slot): index for team, slot, index in snap['send_index']}
+    except (KeyError, TypeError, ValueError) as e:
+        logging.warning('Ignoring malformed snapshot %s (%s)', snapshot_filename(ctx), e)
+        return set()
+
+    ctx.player_names = player_names
+    ctx.rom_names = rom_names
+    ctx.remote_items = remote_items
+    ctx.locations = locations
+    ctx.snapshot_send_index = send_index
+    restored = {'multidata'}
+
+    # items received after the last multisave write are only in the snapshot, but if the
+    # multisave has changed since the snapshot was taken it is the more recent of the two
+    if ctx.save_filename and snap['multisave_hash'] is not None:
+        if snap['multisave_hash'] == await loop.run_in_executor(None, file_hash, ctx.save_filename):
+            ctx.received_items = received_items
+            restored.add('multisave')
+
+    return restored
+
+
+def record_restore(token, elapsed, ctx: MultiServer.Context):
+    restored = getattr(ctx, 'restored_from_snapshot', set())
+    RESTORE_TIMINGS[token] = {
+        'ms': elapsed * 1000,
+        'snapshot': sorted(restored),
+    }
+    logging.info('Restored %s in %.1fms (from snapshot: %s)', token, elapsed * 1000, ', '.join(sorted(restored)) or 'none')
+
+
+async def snapshot_loop(get_servers):
+    signatures = {}
+    while True:
+        await asyncio.sleep(SNAPSHOT_SECONDS)
+        for token, ctx in list(get_servers().items()):
+            try:
+                sig = signature(ctx)
+                if signatures.get(token) == sig:
+                    continue
+                await write(ctx)
+                signatures[token] = sig
+            except Exception:
+                logging.exception('Failed to snapshot %s', token)
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import os
+import sys
+import zlib
+
+import pytest
+
+# the stubs stand in for the door randomizer modules and settings.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'stubs'))
+sys.path.insert(1, os.path.dirname(os.path.dirname(__file__)))
+
+import MultiServer  # noqa: E402
+from tortoise import Tortoise  # noqa: E402
+
+import blobstore  # noqa: E402
+import db  # noqa: E402
+import models  # noqa: E402
+
+
+class FakeSocket:
+    """Client websocket that records everything sent to it."""
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        self.open = True
+        self.remote_address = ('127.0.0.1', 0)
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    def enqueue(self, message, size=None):
+        self.sent.append(message)
+
+    async def close(self):
+        self.closed = True
+        self.open = False
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    # writer tasks of queued sockets outlive the test that started them
+    pending = asyncio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def database(loop, monkeypatch):
+    monkeypatch.setattr(db, '_pending_writes', {})
+    monkeypatch.setattr(db, '_flushing', set())
+    monkeypatch.setattr(db, 'DB_CALLS', {k: 0 for k in db.DB_CALLS})
+    monkeypatch.setattr(db, 'DB_CALLS_BY_OPERATION', {})
+    loop.run_until_complete(db.init(generate_schemas=True))
+    yield
+    loop.run_until_complete(Tortoise.close_connections())
+
+
+@pytest.fixture
+def world(loop, database):
+    return loop.run_until_complete(models.Multiworlds.create(token='testtoken', admin=1, active=True))
+
+
+@pytest.fixture
+def ctx():
+    ctx = MultiServer.Context('0.0.0.0', 30000, None)
+    ctx.clients = [
+        MultiServer.Client(FakeSocket(), 'Alice', team=0, slot=1),
+        MultiServer.Client(FakeSocket(), 'Bob', team=0, slot=2),
+        MultiServer.Client(FakeSocket(), 'Bob', team=1, slot=2),
+        MultiServer.Client(FakeSocket(), 'Eve', team=0, slot=3, auth=False),
+    ]
+    return ctx
+
+
+class FakeServer:
+    class ws_server:
+        sockets = []
+
+        @staticmethod
+        def close():
+            pass
+
+
+class FakeResponse:
+    """Stands in for the response of an aiohttp.request, recording what was requested."""
+    def __init__(self, body=b'', status=200, content_type='application/json', **request):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.request = request
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def read(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def app(loop, database, tmp_path, monkeypatch):
+    """The service module, with game servers stubbed out and files kept in tmp_path."""
+    import MultiworldHostService as app
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    monkeypatch.setattr(blobstore, '_store', None)
+
+    multidata = zlib.compress(json.dumps({'names': [], 'roms': [], 'remote_items': [], 'locations': []}).encode())
+    monkeypatch.setattr(app.aiohttp, 'request', lambda **kwargs: FakeResponse(multidata, **kwargs))
+
+    async def open_multiserver(port, multidatafile, racemode=False, password=None):
+        ctx = MultiServer.Context('0.0.0.0', port, password)
+        ctx.server = FakeServer()
+        ctx.usage = app.accounting.GameUsage()
+        return ctx
+
+    monkeypatch.setattr(app, 'open_multiserver', open_multiserver)
+    monkeypatch.setattr(app, 'multiworld_servers', {})
+    return app
+
+
+@pytest.fixture
+def api(loop, app):
+    """Make a request to the service and return the response."""
+    client = app.APP.test_client()
+
+    def call(method, path, json_body=None, headers=None):
+        return loop.run_until_complete(getattr(client, method)(path, json=json_body, headers=headers))
+    return call
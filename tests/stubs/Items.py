@@ -0,0 +1,6 @@
+# Minimal stand-in for the door randomizer's Items module
+item_table = {
+    'Progressive Sword': (True, False, 'Sword', 0x5E, 'a Sword'),
+    'Pegasus Boots': (True, False, None, 0x4B, 'the Boots'),
+    "Big Key (Ganons Tower)": (False, True, 'BigKey', 0x92, 'a Big Key'),
+}
@@ -0,0 +1,75 @@
+# Minimal stand-in for the door randomizer's MultiServer module, recording what was called
+import collections
+
+import Items
+
+ReceivedItem = collections.namedtuple('ReceivedItem', ['item', 'location', 'player'])
+
+
+class Client:
+    def __init__(self, socket, name, team=0, slot=1, auth=True):
+        self.socket = socket
+        self.name = name
+        self.team = team
+        self.slot = slot
+        self.auth = auth
+        self.send_index = 0
+
+
+class Context:
+    def __init__(self, host, port, password):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.server = None
+        self.clients = []
+        self.player_names = {}
+        self.rom_names = {}
+        self.remote_items = set()
+        self.locations = {}
+        self.received_items = {}
+        self.data_filename = None
+        self.save_filename = None
+        self.disable_save = False
+        self.disable_client_forfeit = False
+
+        self.forfeits = []
+        self.notices = []
+        self.item_sends = 0
+
+
+def init_lookups(ctx):
+    pass
+
+
+def get_connected_players_string(ctx):
+    return ', '.join(c.name for c in ctx.clients if c.auth)
+
+
+def set_password(ctx, password):
+    ctx.password = password
+
+
+def forfeit_player(ctx, team, slot):
+    ctx.forfeits.append((team, slot))
+
+
+def get_received_items(ctx, team, player):
+    return ctx.received_items.setdefault((team, player), [])
+
+
+def notify_all(ctx, text):
+    ctx.notices.append(text)
+
+
+def send_new_items(ctx):
+    ctx.item_sends += 1
+
+
+async def process_client_cmd(ctx, client, cmd, args):
+    pass
+
+
+async def server(websocket, path, ctx):
+    async for data in websocket:
+        pass
@@ -0,0 +1,2 @@
+DB_URL = "sqlite://:memory:"
+DB_RETRY_BACKOFF = 0.001
@@ -0,0 +1,175 @@
+import asyncio
+import time
+
+import MultiServer
+
+import accounting
+import broadcast
+from conftest import FakeResponse
+
+
+def busy(seconds):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+def test_cpu_is_charged_only_to_the_game_doing_the_work(loop):
+    busy_game = accounting.GameUsage()
+    idle_game = accounting.GameUsage()
+
+    async def busy_handler():
+        for _ in range(5):
+            busy(0.01)
+            await asyncio.sleep(0)
+        return 'done'
+
+    async def idle_handler():
+        # suspended while busy_handler runs, and while sleeping
+        await asyncio.sleep(0.1)
+
+    async def run():
+        return await asyncio.gather(
+            accounting.TimedCoroutine(busy_handler(), busy_game),
+            accounting.TimedCoroutine(idle_handler(), idle_game),
+        )
+
+    assert loop.run_until_complete(run())[0] == 'done'
+    assert 0.04 <= busy_game.cpu_seconds < 0.1
+    assert idle_game.cpu_seconds < 0.005
+
+
+def test_timed_coroutine_propagates_exceptions(loop):
+    usage = accounting.GameUsage()
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise ValueError('bad command')
+
+    async def run():
+        try:
+            await accounting.TimedCoroutine(failing(), usage)
+        except ValueError as e:
+            return str(e)
+
+    assert loop.run_until_complete(run()) == 'bad command'
+
+
+def test_install_times_process_client_cmd(loop, ctx, monkeypatch):
+    async def process_client_cmd(ctx, client, cmd, args):
+        busy(0.01)
+
+    monkeypatch.setattr(MultiServer, 'process_client_cmd', process_client_cmd)
+    accounting.install()
+    accounting.install()
+
+    ctx.usage = accounting.GameUsage()
+    loop.run_until_complete(MultiServer.process_client_cmd(ctx, ctx.clients[0], 'Sync', None))
+    assert ctx.usage.cpu_seconds >= 0.01
+
+
+def test_bytes_are_counted_encoded(loop, ctx):
+    usage = accounting.GameUsage()
+    socket = accounting.MeteredSocket(broadcast.QueuedSocket(ctx.clients[0].socket, usage), usage)
+
+    async def run():
+        await socket.send('ñ')
+        # counted once the writer has sent it
+        assert usage.bytes_out == 0
+        await asyncio.sleep(0.01)
+
+    loop.run_until_complete(run())
+    assert (usage.bytes_out, usage.messages_out) == (2, 1)
+
+
+def test_check_applies_each_limit_per_window(ctx, monkeypatch):
+    monkeypatch.setattr(accounting, 'RESOURCE_LIMIT_CPU_SECONDS', 1.0)
+    monkeypatch.setattr(accounting, 'RESOURCE_LIMIT_BYTES_OUT', 100)
+    ctx.usage = accounting.GameUsage()
+
+    ctx.usage.cpu_seconds += 1.5
+    assert accounting.check(ctx) == ['cpu']
+    assert ctx.usage.throttled
+
+    # totals carry on, but each window only counts what was used since the last check
+    ctx.usage.cpu_seconds += 0.5
+    ctx.usage.bytes_out += 150
+    assert accounting.check(ctx) == ['bandwidth']
+    assert (ctx.usage.window_cpu_seconds, ctx.usage.window_bytes_out) == (0.5, 150)
+
+    assert accounting.check(ctx) == []
+    assert not ctx.usage.throttled
+    assert (ctx.usage.cpu_seconds, ctx.usage.bytes_out) == (2.0, 150)
+
+    # memory is a level rather than a rate, so it isn't windowed
+    monkeypatch.setattr(accounting, 'RESOURCE_LIMIT_MEMORY_BYTES', 1)
+    assert accounting.check(ctx) == ['memory']
+    assert accounting.check(ctx) == ['memory']
+
+
+def test_admin_is_warned_when_a_game_goes_over_budget(loop, world, ctx, monkeypatch):
+    monkeypatch.setattr(accounting, 'RESOURCE_CHECK_SECONDS', 0)
+    monkeypatch.setattr(accounting, 'RESOURCE_LIMIT_CPU_SECONDS', 1.0)
+    monkeypatch.setattr(accounting, 'RESOURCE_WARNING_WEBHOOK', 'http://example.invalid/webhook')
+    posts = []
+
+    def request(**kwargs):
+        posts.append(kwargs)
+        return FakeResponse(**kwargs)
+
+    monkeypatch.setattr(accounting.aiohttp, 'request', request)
+
+    ctx.usage = accounting.GameUsage()
+    # CPU seconds used in each window: over budget twice, back under, then over again
+    windows = [2, 2, 0, 2]
+    done = asyncio.Event()
+
+    def get_servers():
+        if not windows:
+            done.set()
+            return {}
+        ctx.usage.cpu_seconds += windows.pop(0)
+        return {'testtoken': ctx}
+
+    async def run():
+        task = asyncio.ensure_future(accounting.accounting_loop(get_servers))
+        await done.wait()
+        task.cancel()
+
+    loop.run_until_complete(run())
+    assert [p['json']['content'] for p in posts] == [
+        '<@1> Multiworld testtoken is over its resource budget (cpu) and is being throttled.',
+    ] * 2
+
+
+def test_game_info_includes_resources(loop, app, api):
+    resp = api('post', '/game', {'multidata_url': 'http://example.invalid/md', 'admin': 1})
+    token = loop.run_until_complete(resp.get_json())['token']
+
+    resources = loop.run_until_complete(api('get', f'/game/{token}').get_json())['resources']
+    assert set(resources) == set(accounting.GameUsage().to_dict())
+    assert not resources['throttled']
+
+    api('delete', f'/game/{token}')
+    assert loop.run_until_complete(api('get', f'/game/{token}').get_json())['resources'] is None
+
+
+def test_resource_overview(loop, app, api):
+    def game(locations, throttled=False):
+        ctx = MultiServer.Context('0.0.0.0', 30000, None)
+        ctx.locations = {(i, 1): (0x5E, 1) for i in range(locations)}
+        ctx.usage = accounting.GameUsage()
+        ctx.usage.throttled = throttled
+        return ctx
+
+    app.multiworld_servers.update({
+        'a-small': game(10),
+        'large': game(1000, throttled=True),
+        'b-medium': game(100),
+    })
+
+    overview = loop.run_until_complete(api('get', '/admin/resources').get_json())
+    assert overview['count'] == 3
+    assert overview['throttled'] == ['large']
+    # largest memory footprint first
+    assert list(overview['games']) == ['large', 'b-medium', 'a-small']
@@ -0,0 +1,199 @@
+"""
+Fan-out tests and benchmark using simulated clients.  Run with -s to see the timings:
+
+    python -m pytest tests/test_broadcast.py -s
+"""
+import asyncio
+import json
+import time
+
+import MultiServer
+import pytest
+
+import accounting
+import broadcast
+
+CLIENTS = 100
+BROADCASTS = 20
+
+
+class SimulatedSocket:
+    """A client connection that takes `delay` seconds to accept each frame."""
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.received = []
+        self.closed = False
+        self.open = True
+        self.remote_address = ('127.0.0.1', 0)
+
+    async def send(self, message):
+        if self.fail:
+            raise RuntimeError('transport broke')
+        await asyncio.sleep(self.delay)
+        self.received.append(message)
+
+    async def close(self):
+        self.closed = True
+        self.open = False
+
+
+def make_game(stalled_delay=0.5, usage=None):
+    usage = usage or accounting.GameUsage()
+    ctx = MultiServer.Context('0.0.0.0', 30000, None)
+    sockets = [SimulatedSocket(stalled_delay if i == 0 else 0.0) for i in range(CLIENTS)]
+    ctx.clients = [
+        MultiServer.Client(accounting.MeteredSocket(broadcast.QueuedSocket(s, usage), usage), f'Player{i}', slot=i + 1)
+        for i, s in enumerate(sockets)
+    ]
+    ctx.usage = usage
+    return ctx, sockets
+
+
+async def delivered(sockets, count):
+    """Wait until every socket has received count frames."""
+    while not all(len(s.received) >= count for s in sockets):
+        await asyncio.sleep(0)
+
+
+def test_benchmark_100_clients_with_one_stalled(loop, capsys):
+    """
+    Time until the healthy clients have every frame, with one client stalling on each
+    send.  With per-client queues that should be about the same as with no stalled client.
+    """
+    msgs = [['Print', 'x' * 200]]
+
+    async def run_queued(stalled_delay):
+        ctx, sockets = make_game(stalled_delay=stalled_delay)
+        start = time.perf_counter()
+        for _ in range(BROADCASTS):
+            broadcast.broadcast(ctx, msgs)
+            # other work gets a turn between broadcasts
+            await asyncio.sleep(0)
+        await delivered(sockets[1:], BROADCASTS)
+        return time.perf_counter() - start, sockets, len(sockets[0].received)
+
+    async def run_sequential():
+        # no queues: encode and await each client in turn, as sends used to
+        sockets = [SimulatedSocket(0.05 if i == 0 else 0.0) for i in range(CLIENTS)]
+        start = time.perf_counter()
+        for _ in range(BROADCASTS):
+            for socket in sockets:
+                await socket.send(json.dumps(msgs))
+        return time.perf_counter() - start
+
+    baseline, _, _ = loop.run_until_complete(run_queued(0.0))
+    stalled, sockets, stalled_received = loop.run_until_complete(run_queued(0.05))
+    sequential = loop.run_until_complete(run_sequential())
+
+    with capsys.disabled():
+        print(f'\n{BROADCASTS} broadcasts to {CLIENTS} clients, time until the {CLIENTS - 1} healthy clients have every frame:')
+        print(f'  queued, no stalled client:   {baseline * 1000:8.1f}ms')
+        print(f'  queued, one stalling 50ms:   {stalled * 1000:8.1f}ms')
+        print(f'  sequential, one stalling:    {sequential * 1000:8.1f}ms')
+
+    assert stalled < baseline * 2 + 0.02
+    assert all(len(s.received) == BROADCASTS for s in sockets[1:])
+    # the healthy clients were done while the stalled one was still working through its queue
+    assert stalled_received < BROADCASTS
+    # every client got the very same payload object
+    assert len({id(s.received[0]) for s in sockets[1:]}) == 1
+
+
+def test_stalled_client_is_disconnected_when_its_queue_fills(loop, monkeypatch):
+    monkeypatch.setattr(broadcast, 'SEND_QUEUE_SIZE', 5)
+    monkeypatch.setattr(broadcast, 'SEND_QUEUE_POLICY', 'disconnect')
+
+    async def run():
+        ctx, sockets = make_game(stalled_delay=10)
+        for _ in range(10):
+            broadcast.notify_all(ctx, 'hello')
+            # give the writers a turn between broadcasts, as the event loop would
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        return ctx, sockets
+
+    ctx, sockets = loop.run_until_complete(run())
+    assert sockets[0].closed
+    assert not any(s.closed for s in sockets[1:])
+    assert all(len(s.received) == 10 for s in sockets[1:])
+
+
+def test_drop_policy_keeps_the_client(loop, monkeypatch):
+    monkeypatch.setattr(broadcast, 'SEND_QUEUE_SIZE', 5)
+    monkeypatch.setattr(broadcast, 'SEND_QUEUE_POLICY', 'drop')
+
+    async def run():
+        ctx, sockets = make_game(stalled_delay=10)
+        for _ in range(10):
+            broadcast.notify_all(ctx, 'hello')
+            # give the writers a turn between broadcasts, as the event loop would
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        return ctx, sockets
+
+    ctx, sockets = loop.run_until_complete(run())
+    assert not sockets[0].closed
+    assert ctx.clients[0].socket.dropped > 0
+    # only frames that were actually sent count towards the game's bandwidth
+    frame = broadcast.message_size(json.dumps([['Print', 'hello']]))
+    assert ctx.usage.messages_out == sum(len(s.received) for s in sockets)
+    assert ctx.usage.bytes_out == frame * ctx.usage.messages_out
+
+
+def test_throttled_game_does_not_block_the_caller(loop, monkeypatch):
+    monkeypatch.setattr(broadcast, 'RESOURCE_THROTTLE_DELAY', 0.05)
+    usage = accounting.GameUsage()
+    usage.throttled = True
+
+    async def run():
+        ctx, sockets = make_game(stalled_delay=0.0, usage=usage)
+        start = time.perf_counter()
+        broadcast.notify_all(ctx, 'hello')
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(0.1)
+        return elapsed, sockets
+
+    elapsed, sockets = loop.run_until_complete(run())
+    assert elapsed < 0.05
+    assert all(len(s.received) == 1 for s in sockets)
+
+
+def test_writer_failure_closes_the_socket(loop):
+    async def run():
+        socket = SimulatedSocket(fail=True)
+        queued = broadcast.QueuedSocket(socket)
+        queued.enqueue('hello')
+        await asyncio.sleep(0.01)
+        queued.enqueue('ignored')
+        return socket, queued
+
+    socket, queued = loop.run_until_complete(run())
+    assert socket.closed
+    # nothing is queued once the socket is closing
+    assert queued.queued_bytes() == 0
+
+
+def test_queued_bytes(loop):
+    async def run():
+        queued = broadcast.QueuedSocket(SimulatedSocket(delay=10))
+        queued.enqueue('abc', 3)
+        queued.enqueue('defg', 4)
+        await asyncio.sleep(0)
+        # the first message has been handed to the stalled socket
+        return queued.queued_bytes()
+
+    assert loop.run_until_complete(run()) == 4
+
+
+@pytest.mark.parametrize('calls', [1, 10])
+def test_item_sends_are_coalesced(loop, ctx, monkeypatch, calls):
+    monkeypatch.setattr(broadcast, 'ITEM_COALESCE_SECONDS', 0.01)
+
+    async def run():
+        for _ in range(calls):
+            broadcast.send_new_items(ctx)
+        await asyncio.sleep(0.05)
+
+    loop.run_until_complete(run())
+    assert ctx.item_sends == 1
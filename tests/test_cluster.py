@@ -0,0 +1,181 @@
+import asyncio
+import datetime
+
+import pytest
+
+import blobstore
+import cluster
+import models
+from conftest import FakeResponse
+
+
+@pytest.fixture
+def node(monkeypatch):
+    def set_node(node_id):
+        monkeypatch.setattr(cluster, 'NODE_ID', node_id)
+        monkeypatch.setattr(cluster, 'NODE_URL', f'http://{node_id}:5002')
+    set_node('node1')
+    return set_node
+
+
+def expire(loop, world):
+    past = cluster.now() - datetime.timedelta(seconds=1)
+    loop.run_until_complete(models.Multiworlds.filter(id=world.id).update(lease_expires_at=past))
+
+
+def own(loop, world, node_id, active=True):
+    loop.run_until_complete(models.Multiworlds.filter(id=world.id).update(
+        node=node_id,
+        node_url=f'http://{node_id}:5002',
+        lease_expires_at=cluster.lease_expiry(),
+        active=active,
+    ))
+
+
+def test_claim(loop, world, node):
+    assert loop.run_until_complete(cluster.claim(world))
+    assert world.node == 'node1'
+
+    # a live lease can't be claimed by another node
+    node('node2')
+    other = loop.run_until_complete(models.Multiworlds.get(id=world.id))
+    assert not loop.run_until_complete(cluster.claim(other))
+    assert cluster.is_owned_elsewhere(other)
+
+    expire(loop, world)
+    assert loop.run_until_complete(cluster.claim(other))
+    assert other.node == 'node2'
+
+
+def test_renew_reports_games_taken_over(loop, world, node):
+    loop.run_until_complete(cluster.claim(world))
+    assert loop.run_until_complete(cluster.renew(['testtoken'])) == set()
+
+    # node1 stalls past its lease and node2 takes the game over
+    expire(loop, world)
+    node('node2')
+    assert loop.run_until_complete(cluster.claim(world))
+
+    node('node1')
+    assert loop.run_until_complete(cluster.renew(['testtoken'])) == {'testtoken'}
+    saved = loop.run_until_complete(models.Multiworlds.get(id=world.id))
+    assert saved.node == 'node2'
+
+
+def test_proxy_to_owner(loop, world, node, app, api, monkeypatch):
+    own(loop, world, 'node2')
+    requests = []
+
+    def request(**kwargs):
+        requests.append(kwargs)
+        return FakeResponse(b'{"proxied": true}', **kwargs)
+
+    monkeypatch.setattr(cluster, 'ROUTING', 'proxy')
+    monkeypatch.setattr(cluster.aiohttp, 'request', request)
+
+    resp = api('get', '/game/testtoken')
+    assert resp.status_code == 200
+    assert loop.run_until_complete(resp.get_json()) == {'proxied': True}
+    assert requests[0]['url'].startswith('http://node2:5002/game/testtoken')
+    assert requests[0]['headers'][cluster.PROXY_HEADER] == 'node1'
+
+    # a request another node already proxied is answered here, so two nodes that
+    # disagree about the owner can't bounce it back and forth
+    resp = api('get', '/game/testtoken', headers={cluster.PROXY_HEADER: 'node2'})
+    assert loop.run_until_complete(resp.get_json())['node'] == 'node2'
+    assert len(requests) == 1
+
+
+def test_redirect_to_owner(loop, world, node, app, api, monkeypatch):
+    own(loop, world, 'node2')
+    monkeypatch.setattr(cluster, 'ROUTING', 'redirect')
+
+    resp = api('get', '/game/testtoken')
+    assert resp.status_code == 307
+    assert resp.headers['Location'].startswith('http://node2:5002/game/testtoken')
+
+    # games whose lease has lapsed are served locally
+    expire(loop, world)
+    assert api('get', '/game/testtoken').status_code == 200
+
+
+def test_closed_game_can_be_reopened_on_another_node(loop, database, node, app, api):
+    node('node2')
+    resp = api('post', '/game', {'multidata_url': 'http://example.invalid/md', 'admin': 1})
+    token = loop.run_until_complete(resp.get_json())['token']
+    assert api('delete', f'/game/{token}').status_code == 200
+
+    saved = loop.run_until_complete(models.Multiworlds.get(token=token))
+    assert (saved.active, saved.node, saved.lease_expires_at) == (False, None, None)
+
+    node('node1')
+    resp = api('post', '/game', {'token': token})
+    info = loop.run_until_complete(resp.get_json())
+    assert (info['active'], info['node']) == (True, 'node1')
+
+
+def test_reopening_a_game_leased_elsewhere(loop, world, node, app, api):
+    # closed by a node that didn't give up its lease
+    own(loop, world, 'node2', active=False)
+
+    resp = api('post', '/game', {'token': 'testtoken'})
+    body = loop.run_until_complete(resp.get_json())
+    assert (body['success'], body['status_code']) == (False, 400)
+    assert 'testtoken' not in app.multiworld_servers
+
+
+def test_heartbeat_takes_over_orphaned_games(loop, world, node, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cluster, 'HEARTBEAT_SECONDS', 0)
+
+    # testtoken's owner has died, and node2 has taken lost over from this node
+    own(loop, world, 'node2')
+    expire(loop, world)
+    lost = loop.run_until_complete(models.Multiworlds.create(token='lost', admin=1, active=True))
+    own(loop, lost, 'node2')
+
+    local = {'lost'}
+    released = []
+
+    async def takeover(w):
+        assert await cluster.claim(w)
+        local.add(w.token)
+
+    def release(token):
+        local.discard(token)
+        released.append(token)
+
+    async def run():
+        task = asyncio.ensure_future(cluster.heartbeat(lambda: list(local), takeover, release))
+        for _ in range(100):
+            if 'testtoken' in local:
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    loop.run_until_complete(run())
+    assert local == {'testtoken'}
+    assert released == ['lost']
+    saved = loop.run_until_complete(models.Multiworlds.get(id=world.id))
+    assert saved.node == 'node1'
+
+
+def test_pull_prefers_the_blob_store(loop, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    monkeypatch.setattr(blobstore, '_store', blobstore.LocalBlobStore(str(tmp_path / 'blobs')))
+
+    local = tmp_path / 'data' / 'testtoken_multisave'
+    local.write_bytes(b'latest')
+    loop.run_until_complete(blobstore.push('testtoken_multisave'))
+    assert (tmp_path / 'blobs' / 'testtoken_multisave').read_bytes() == b'latest'
+
+    # e.g. left behind from when this node last hosted the game
+    local.write_bytes(b'stale')
+    loop.run_until_complete(blobstore.pull('testtoken_multisave', prefer_local=True))
+    assert local.read_bytes() == b'stale'
+    loop.run_until_complete(blobstore.pull('testtoken_multisave', prefer_local=False))
+    assert local.read_bytes() == b'latest'
+
+    with pytest.raises(FileNotFoundError):
+        loop.run_until_complete(blobstore.pull('testtoken_multidata'))
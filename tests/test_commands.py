@@ -0,0 +1,146 @@
+import json
+
+import pytest
+
+import commands
+
+
+def run(loop, ctx, world, cmd, kwargs):
+    return loop.run_until_complete(commands.dispatch(cmd, kwargs, ctx, world))
+
+
+def chat(loop, ctx, world, raw):
+    cmd, kwargs = commands.parse_chat(raw)
+    return run(loop, ctx, world, cmd, kwargs)
+
+
+def rest(loop, ctx, world, data):
+    cmd, kwargs = commands.parse_request(data)
+    return run(loop, ctx, world, cmd, kwargs)
+
+
+def printed(ctx):
+    return [json.loads(m)[0][1] for m in ctx.clients[0].socket.sent]
+
+
+@pytest.mark.parametrize('raw, name, kwargs', [
+    ('/players', 'players', {}),
+    ('/password', 'password', {'password': None}),
+    ('/password hunter2', 'password', {'password': 'hunter2'}),
+    ('/kick bob', 'kick', {'name': 'bob', 'team': None}),
+    ('/kick bob 2', 'kick', {'name': 'bob', 'team': 1}),
+    ('/forfeitslot 3', 'forfeitslot', {'team': 0, 'slot': 3}),
+    ('/forfeitslot 2 3', 'forfeitslot', {'team': 1, 'slot': 3}),
+    ('/forfeitplayer bob', 'forfeitplayer', {'name': 'bob', 'team': None}),
+    ('/forfeit bob 1', 'forfeitplayer', {'name': 'bob', 'team': 0}),
+    ('/senditem bob Progressive Sword', 'senditem', {'player': 'bob', 'item': 'Progressive Sword'}),
+    ('/senditem "Bob Smith" Pegasus Boots', 'senditem', {'player': 'Bob Smith', 'item': 'Pegasus Boots'}),
+    ('hello there', 'say', {'message': 'hello there'}),
+    ('/close', 'close', {}),
+    ('/exit', 'close', {}),
+])
+def test_parse_chat(raw, name, kwargs):
+    cmd, parsed = commands.parse_chat(raw)
+    assert cmd.name == name
+    assert parsed == kwargs
+
+
+@pytest.mark.parametrize('raw, error', [
+    ('/nope', 'Invalid command nope'),
+    ('/kick', 'No name specified.'),
+    ('/senditem bob', 'No item specified.'),
+    ('/forfeitslot x', 'Invalid value for slot: x'),
+    ("/senditem bob Link's House", 'Could not parse command'),
+])
+def test_parse_chat_errors(raw, error):
+    with pytest.raises(commands.CommandError, match=error):
+        commands.parse_chat(raw)
+
+
+def test_parse_chat_blank():
+    assert commands.parse_chat('   ') == (None, None)
+
+
+def test_parse_request():
+    cmd, kwargs = commands.parse_request({'command': 'forfeit', 'name': 'bob', 'team': 0})
+    assert cmd.name == 'forfeitplayer'
+    assert kwargs == {'name': 'bob', 'team': 0}
+
+    with pytest.raises(commands.CommandError, match='No command specified.'):
+        commands.parse_request({})
+    with pytest.raises(commands.CommandError, match='No player specified.'):
+        commands.parse_request({'command': 'senditem', 'item': 'Pegasus Boots'})
+
+
+def test_players(loop, ctx, world):
+    assert chat(loop, ctx, world, '/players') == ('Players: Alice, Bob, Bob', True)
+
+
+def test_password(loop, ctx, world):
+    assert rest(loop, ctx, world, {'command': 'password', 'password': 'hunter2'}) == ('Password set.', True)
+    assert ctx.password == 'hunter2'
+    loop.run_until_complete(world.refresh_from_db())
+    assert world.password == 'hunter2'
+
+    assert chat(loop, ctx, world, '/password') == ('Password removed.', True)
+    assert ctx.password is None
+
+
+def test_kick(loop, ctx, world):
+    assert chat(loop, ctx, world, '/kick bob 2') == ("Kicked player 'bob'.", True)
+    assert ctx.clients[2].socket.closed
+    assert not ctx.clients[1].socket.closed
+
+    assert rest(loop, ctx, world, {'command': 'kick', 'name': 'eve'}) == ("Player 'eve' not found.", False)
+
+
+def test_forfeitslot(loop, ctx, world):
+    assert chat(loop, ctx, world, '/forfeitslot 3') == ('Forfeited player in slot 3 on team 1.', True)
+    assert chat(loop, ctx, world, '/forfeitslot 2 3') == ('Forfeited player in slot 3 on team 2.', True)
+    assert ctx.forfeits == [(0, 3), (1, 3)]
+
+
+def test_forfeitplayer_without_team(loop, ctx, world):
+    assert chat(loop, ctx, world, '/forfeitplayer alice') == ("Forfeited player 'alice' from team 1.", True)
+    assert ctx.forfeits == [(0, 1)]
+
+
+def test_forfeit_rest_is_case_insensitive(loop, ctx, world):
+    assert rest(loop, ctx, world, {'command': 'forfeit', 'name': 'BOB', 'team': 1}) == ("Forfeited player 'BOB' from team 2.", True)
+    assert ctx.forfeits == [(1, 2)]
+
+
+def test_senditem(loop, ctx, world):
+    resp = chat(loop, ctx, world, '/senditem bob Progressive Sword')
+    assert resp == ('Sent Progressive Sword to bob.', True)
+    assert ctx.received_items[(0, 2)] == [(0x5E, 'cheat console', 2)]
+    assert ctx.received_items[(1, 2)] == [(0x5E, 'cheat console', 2)]
+    assert printed(ctx) == ['Cheat console: sending "Progressive Sword" to Bob'] * 2
+
+    assert rest(loop, ctx, world, {'command': 'senditem', 'player': 'bob', 'item': 'Master Sword'}) == ('Unknown item: Master Sword', False)
+
+
+def test_say(loop, ctx, world):
+    assert chat(loop, ctx, world, 'hello there') == (None, True)
+    assert printed(ctx) == ['[Server]: hello there']
+    # unauthenticated clients don't get broadcasts
+    assert ctx.clients[3].socket.sent == []
+
+
+def test_close(loop, ctx, world, monkeypatch):
+    closed = []
+
+    async def close_game(w):
+        closed.append(w.token)
+
+    monkeypatch.setattr(commands, '_close_handler', None)
+    assert chat(loop, ctx, world, '/exit') == ('Closing games is not available.', False)
+
+    monkeypatch.setattr(commands, '_close_handler', close_game)
+    assert rest(loop, ctx, world, {'command': 'close'}) == ('Game closed.', True)
+    assert closed == ['testtoken']
+
+
+def test_timings(loop, ctx, world):
+    chat(loop, ctx, world, '/players')
+    assert commands.get_timings()['players']['count'] >= 1
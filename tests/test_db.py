@@ -0,0 +1,186 @@
+import asyncio
+import datetime
+
+import pytest
+import tortoise.exceptions
+
+import db
+import models
+
+
+def test_retry_on_transient_error(loop, database):
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise tortoise.exceptions.DBConnectionError('connection refused')
+        return 'ok'
+
+    assert loop.run_until_complete(db.retry(flaky)) == 'ok'
+    assert len(attempts) == 3
+    assert db.DB_CALLS['retry'] == 2
+
+
+def test_retry_on_lost_mysql_connection(loop, database):
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise tortoise.exceptions.OperationalError(Exception(2006, 'MySQL server has gone away'))
+        return 'ok'
+
+    assert loop.run_until_complete(db.retry(flaky)) == 'ok'
+    assert len(attempts) == 2
+
+
+def test_retry_gives_up(loop, database):
+    async def down():
+        raise tortoise.exceptions.DBConnectionError('connection refused')
+
+    with pytest.raises(tortoise.exceptions.DBConnectionError):
+        loop.run_until_complete(db.retry(down))
+    assert db.DB_CALLS['read'] == db.DB_RETRIES + 1
+
+
+def test_no_retry_on_other_operational_errors(loop, database):
+    async def bad_query():
+        raise tortoise.exceptions.OperationalError(Exception(1064, 'syntax error'))
+
+    with pytest.raises(tortoise.exceptions.OperationalError):
+        loop.run_until_complete(db.retry(bad_query))
+    assert db.DB_CALLS['retry'] == 0
+
+
+def test_no_retry_on_integrity_error(loop, world):
+    with pytest.raises(tortoise.exceptions.IntegrityError):
+        loop.run_until_complete(db.create_world(token='testtoken'))
+    assert db.DB_CALLS['write'] == 1
+    assert db.DB_CALLS['retry'] == 0
+
+
+def test_no_retry_on_does_not_exist(loop, database):
+    with pytest.raises(tortoise.exceptions.DoesNotExist):
+        loop.run_until_complete(db.get_world('nope'))
+    assert db.DB_CALLS['read'] == 1
+    assert db.DB_CALLS['retry'] == 0
+
+
+def test_save_coalesces_writes_to_the_same_row(loop, world):
+    async def two_saves():
+        # separate instances of the same row, as two request handlers would have
+        other = await models.Multiworlds.get(token='testtoken')
+        world.port = 31000
+        other.admin = 5
+        await asyncio.gather(db.save(world, 'port'), db.save(other, 'admin'))
+
+    writes = db.DB_CALLS['write']
+    loop.run_until_complete(two_saves())
+    assert db.DB_CALLS['write'] == writes + 1
+    assert db.DB_CALLS['coalesced'] == 1
+
+    saved = loop.run_until_complete(models.Multiworlds.get(token='testtoken'))
+    assert (saved.port, saved.admin) == (31000, 5)
+
+
+def test_sequential_saves_are_not_delayed(loop, world):
+    async def saves():
+        for port in (31000, 31001, 31002):
+            world.port = port
+            await db.save(world, 'port')
+
+    writes = db.DB_CALLS['write']
+    loop.run_until_complete(saves())
+    assert db.DB_CALLS['write'] == writes + 3
+    assert db.DB_CALLS['coalesced'] == 0
+
+
+def test_saves_during_a_write_are_merged_into_the_next(loop, world, monkeypatch):
+    started = asyncio.Event()
+    release = asyncio.Event()
+    save = models.Multiworlds.save
+
+    async def slow_save(self, *args, **kwargs):
+        started.set()
+        await release.wait()
+        return await save(self, *args, **kwargs)
+
+    monkeypatch.setattr(models.Multiworlds, 'save', slow_save)
+
+    async def saves():
+        world.port = 31000
+        first = asyncio.ensure_future(db.save(world, 'port'))
+        await started.wait()
+        world.admin = 5
+        second = asyncio.ensure_future(db.save(world, 'admin'))
+        world.noexpiry = True
+        third = asyncio.ensure_future(db.save(world, 'noexpiry'))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(first, second, third)
+
+    writes = db.DB_CALLS['write']
+    loop.run_until_complete(saves())
+    assert db.DB_CALLS['write'] == writes + 2
+    assert db.DB_CALLS['coalesced'] == 1
+
+    saved = loop.run_until_complete(models.Multiworlds.get(token='testtoken'))
+    assert (saved.port, saved.admin, saved.noexpiry) == (31000, 5, True)
+
+
+def test_create_retried_after_a_committed_insert(loop, database, monkeypatch):
+    create = models.Multiworlds.create.__func__
+    attempts = []
+
+    async def create_then_lose_connection(cls, **kwargs):
+        attempts.append(1)
+        world = await create(cls, **kwargs)
+        if len(attempts) == 1:
+            raise tortoise.exceptions.DBConnectionError('connection lost')
+        return world
+
+    monkeypatch.setattr(models.Multiworlds, 'create', classmethod(create_then_lose_connection))
+
+    world = loop.run_until_complete(db.create_world(token='newtoken', multidata_url='http://example.invalid/md', admin=1))
+    assert world.token == 'newtoken'
+    assert db.DB_CALLS['retry'] == 1
+    assert loop.run_until_complete(models.Multiworlds.filter(token='newtoken').count()) == 1
+
+
+def test_save_bumps_updated_at(loop, world):
+    old = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    loop.run_until_complete(models.Multiworlds.filter(id=world.id).update(updated_at=old))
+
+    world.noexpiry = True
+    loop.run_until_complete(db.save(world, 'noexpiry'))
+
+    saved = loop.run_until_complete(models.Multiworlds.get(token='testtoken'))
+    assert saved.noexpiry
+    assert saved.updated_at > old
+
+
+def test_db_calls_per_api_operation(loop, api, capsys):
+    """Records how many queries each API operation issues, so regressions show up here."""
+    def request(method, path, json_body=None):
+        resp = api(method, path, json_body)
+        assert resp.status_code == 200, loop.run_until_complete(resp.get_data())
+        return loop.run_until_complete(resp.get_json())
+
+    token = request('post', '/game', {'multidata_url': 'http://example.invalid/md', 'admin': 1})['token']
+    request('put', f'/game/{token}/noexpiry', {'value': True})
+    request('put', f'/game/{token}/cmd', {'command': 'password', 'password': 'hunter2'})
+    request('delete', f'/game/{token}')
+
+    operations = db.get_stats()['operations']
+    with capsys.disabled():
+        print('\nDB calls per API operation:')
+        for operation, calls in operations.items():
+            print(f"  {operation:<24} read={calls['read']} write={calls['write']} coalesced={calls['coalesced']}")
+
+    assert {op: (c['read'], c['write']) for op, c in operations.items()} == {
+        'create_game': (0, 2),
+        'update_game_parameter': (1, 1),
+        'cmd': (1, 1),
+        'delete_game': (1, 1),
+    }
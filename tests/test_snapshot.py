@@ -0,0 +1,148 @@
+import json
+import random
+import time
+import zlib
+
+import MultiServer
+import pytest
+
+import snapshot
+
+
+def make_ctx(tmp_path):
+    ctx = MultiServer.Context('0.0.0.0', 30000, None)
+    ctx.data_filename = str(tmp_path / 'token_multidata')
+    ctx.save_filename = str(tmp_path / 'token_multisave')
+    for name in ('multidata', 'multisave'):
+        if not (tmp_path / f'token_{name}').exists():
+            (tmp_path / f'token_{name}').write_bytes(name.encode())
+    ctx.multidata_hash = snapshot.file_hash(ctx.data_filename)
+    return ctx
+
+
+@pytest.fixture
+def saved(loop, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+
+    ctx = make_ctx(tmp_path)
+    ctx.player_names = {(0, 1): 'Alice', (0, 2): 'Bob'}
+    ctx.rom_names = {(1, 2, 3): (0, 1), (4, 5, 6): (0, 2)}
+    ctx.remote_items = {1}
+    ctx.locations = {(100, 1): (0x5E, 2)}
+    ctx.received_items = {(0, 2): [MultiServer.ReceivedItem(0x5E, 100, 1)]}
+    ctx.clients = [MultiServer.Client(None, 'Bob', team=0, slot=2)]
+    ctx.clients[0].send_index = 1
+    loop.run_until_complete(snapshot.write(ctx))
+    return ctx
+
+
+def test_round_trip(loop, saved, tmp_path):
+    ctx = make_ctx(tmp_path)
+    assert loop.run_until_complete(snapshot.restore(ctx)) == {'multidata', 'multisave'}
+    assert ctx.player_names == saved.player_names
+    assert ctx.rom_names == saved.rom_names
+    assert ctx.remote_items == saved.remote_items
+    assert ctx.locations == saved.locations
+    assert ctx.received_items == saved.received_items
+    assert isinstance(ctx.received_items[(0, 2)][0], MultiServer.ReceivedItem)
+    assert ctx.snapshot_send_index == {(0, 2): 1}
+
+
+def test_changed_multisave_is_parsed_instead(loop, saved, tmp_path):
+    ctx = make_ctx(tmp_path)
+    (tmp_path / 'token_multisave').write_bytes(b'newer multisave')
+    assert loop.run_until_complete(snapshot.restore(ctx)) == {'multidata'}
+    assert ctx.received_items == {}
+
+
+def test_changed_multidata_ignores_snapshot(loop, saved, tmp_path):
+    ctx = make_ctx(tmp_path)
+    ctx.multidata_hash = 'something else'
+    assert loop.run_until_complete(snapshot.restore(ctx)) == set()
+
+
+def test_snapshot_is_not_executable(loop, saved, tmp_path):
+    # a snapshot file in another format (e.g. an old pickle) is ignored rather than loaded
+    (tmp_path / 'token_snapshot').write_bytes(b'\x80\x04\x95')
+    assert loop.run_until_complete(snapshot.restore(make_ctx(tmp_path))) == set()
+
+
+def test_empty_game_round_trip(loop, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    loop.run_until_complete(snapshot.write(make_ctx(tmp_path)))
+
+    ctx = make_ctx(tmp_path)
+    assert loop.run_until_complete(snapshot.restore(ctx)) == {'multidata', 'multisave'}
+    assert (ctx.player_names, ctx.locations, ctx.received_items) == ({}, {}, {})
+
+
+def write_game(tmp_path, players=100, locations=220):
+    """Write the multidata and multisave of a game with every player halfway through."""
+    rng = random.Random(1)
+    roms = [[slot, 0, [rng.randrange(256) for _ in range(21)]] for slot in range(1, players + 1)]
+    placements = [
+        [[0x180000 + 7 * location, slot], [rng.randrange(0x10, 0xD0), rng.randrange(1, players + 1)]]
+        for slot in range(1, players + 1) for location in range(locations)
+    ]
+    multidata = {
+        'names': [[f'Player{slot}' for slot in range(1, players + 1)]],
+        'roms': roms,
+        'remote_items': [],
+        'locations': placements,
+    }
+
+    received_items = {}
+    for (location, finder), (item, owner) in placements[::2]:
+        received_items.setdefault((0, owner), []).append({'item': item, 'location': location, 'player': finder})
+    multisave = [
+        [[rom, [team, slot]] for slot, team, rom in roms],
+        [[list(k), v] for k, v in received_items.items()],
+    ]
+
+    (tmp_path / 'token_multidata').write_bytes(zlib.compress(json.dumps(multidata).encode('utf-8')))
+    (tmp_path / 'token_multisave').write_bytes(zlib.compress(json.dumps(multisave).encode('utf-8')))
+
+
+def test_restore_is_faster_than_parsing(loop, tmp_path, monkeypatch, capsys):
+    import MultiworldHostService as app
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    write_game(tmp_path)
+
+    def parse():
+        ctx = make_ctx(tmp_path)
+        assert app.load_multidata(ctx)
+        app.load_multisave(ctx)
+        return ctx
+
+    def restore():
+        ctx = make_ctx(tmp_path)
+        assert loop.run_until_complete(snapshot.restore(ctx)) == {'multidata', 'multisave'}
+        return ctx
+
+    parsed = parse()
+    loop.run_until_complete(snapshot.write(parsed))
+    restored = restore()
+    for name in ('player_names', 'rom_names', 'remote_items', 'locations', 'received_items'):
+        assert getattr(restored, name) == getattr(parsed, name)
+
+    def best_of(func, runs=5):
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    parse_time, restore_time = best_of(parse), best_of(restore)
+    sources = (tmp_path / 'token_multidata').stat().st_size + (tmp_path / 'token_multisave').stat().st_size
+    with capsys.disabled():
+        print('\nRestoring 100 players x 220 locations:')
+        print(f'  parse multidata + multisave: {parse_time * 1000:6.1f}ms ({sources // 1024} KB)')
+        print(f'  restore from snapshot:       {restore_time * 1000:6.1f}ms ({(tmp_path / "token_snapshot").stat().st_size // 1024} KB)')
+
+    assert restore_time < parse_time * 0.75
+    assert (tmp_path / 'token_snapshot').stat().st_size < sources